@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from math import inf
+import gamerecord
+from gameengine import AI, Difficulty
+from state import State
+
+# Post-game analysis.
+#
+# Replays recorded games (see gamerecord.py) and searches every position
+# with the AI, to find the moves where a player threw away a win, walked
+# into a loss, or lost more than a threshold of evaluation compared to the
+# best move. A move here is a turn of the AI's: placing the held piece and
+# picking the next one, or only the pick on the first turn.
+#
+# Games are analyzed in parallel, one game per task, and the results are
+# written as soon as they are done, in the order of the games, one line of
+# JSON per game:
+#   game      index of the game in the record file
+#   players   names of the players
+#   result    result of the game, see gamerecord
+#   turns     number of turns analyzed
+#   blunders  one entry per flagged turn, with the turn number, player,
+#             move played and best move ([square, piece], square as
+#             row*4 + col) and their scores, "win" or "loss" when the search
+#             found the game decided
+# Records are read as the workers need them, so the record file is never
+# loaded at once.
+#
+# Example: python3 analysis.py games.qgr --output blunders.jsonl
+
+# Default least drop in evaluation for a move to be flagged
+DEFAULT_THRESHOLD = 25
+
+# Number of games queued per worker, ahead of the one it analyzes
+_queued_per_worker = 2
+
+# AI of a worker process, see _analyzer
+_worker_ai = None
+
+def _analyzer():
+    global _worker_ai
+    if _worker_ai is None:
+        # The book moves are not searched, so they can't be scored
+        _worker_ai = AI(Difficulty.HIGH, book=None)
+    return _worker_ai
+
+# Splits the moves of a record into turns, as (player index, move) pairs,
+# where moves are (square, piece) pairs as the AI makes them. A last turn
+# cut short (the game stopped between placing and picking without being
+# over) is left out.
+def _turns(moves):
+    if not moves:
+        return
+    yield 0, (None, moves[0])
+    state = State()
+    state.pick_piece(moves[0])
+    for t, i in enumerate(range(1, len(moves), 2), 1):
+        square = (moves[i] >> 2, moves[i] & 3)
+        piece = moves[i + 1] if i + 1 < len(moves) else None
+        if piece is None:
+            state.place_piece(*square)
+            if state.has_winner() or not state.pieces:
+                yield t % 2, (square, None)
+            return
+        yield t % 2, (square, piece)
+        state.place_piece(*square)
+        state.pick_piece(piece)
+
+def _score(val):
+    if val == inf:
+        return "win"
+    if val == -inf:
+        return "loss"
+    return val
+
+def _move(move):
+    square, piece = move
+    return [None if square is None else 4*square[0] + square[1], piece]
+
+def _is_blunder(best, played, threshold):
+    if best == played:
+        return False
+    if best == inf or played == -inf:
+        return True
+    return best - played > threshold
+
+# Runs in a worker process. Analyzes the game, see above.
+def analyze_game(index, record, threshold=DEFAULT_THRESHOLD, max_depth=inf):
+    ai = _analyzer()
+    state = State()
+    blunders = []
+    turns = 0
+    for player, move in _turns(record.moves):
+        best, best_move, played = ai.evaluate_move(state, move,
+                                                   max_depth=max_depth)
+        if _is_blunder(best, played, threshold):
+            blunders.append({"turn": turns,
+                             "player": record.players[player],
+                             "move": _move(move),
+                             "best_move": _move(best_move),
+                             "score": _score(played),
+                             "best_score": _score(best)})
+        square, piece = move
+        if square is not None:
+            state.place_piece(*square)
+        if piece is not None:
+            state.pick_piece(piece)
+        turns += 1
+    return {"game": index,
+            "players": list(record.players),
+            "result": record.result,
+            "turns": turns,
+            "blunders": blunders}
+
+# Analyzes the games of the record file at records_path, writing the results
+# to output_path. Returns the number of games analyzed.
+def run(records_path, output_path, threshold=DEFAULT_THRESHOLD,
+        max_depth=inf, workers=None):
+    workers = workers or os.cpu_count()
+    pending = deque()
+    games = 0
+    with open(output_path, "w") as out, \
+            ProcessPoolExecutor(workers) as pool:
+        def write(future):
+            out.write(json.dumps(future.result()) + "\n")
+            out.flush()
+        for index, record in enumerate(gamerecord.read(records_path)):
+            pending.append(pool.submit(analyze_game, index, record,
+                                       threshold, max_depth))
+            if len(pending) > workers * _queued_per_worker:
+                write(pending.popleft())
+            games += 1
+        while pending:
+            write(pending.popleft())
+    return games
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Finds the blunders of recorded games.")
+    parser.add_argument("records", help="game record file")
+    parser.add_argument("--output", default="analysis.jsonl",
+                        help="file to write the analysis to "
+                             "(default analysis.jsonl)")
+    parser.add_argument("--threshold", type=float,
+                        default=DEFAULT_THRESHOLD,
+                        help="least drop in evaluation to flag a move "
+                             "(default {})".format(DEFAULT_THRESHOLD))
+    parser.add_argument("--depth", type=int, default=None,
+                        help="max search depth (default the AI's)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="number of processes (default all cores)")
+    args = parser.parse_args()
+    max_depth = args.depth if args.depth is not None else inf
+    games = run(args.records, args.output, args.threshold, max_depth,
+                args.workers)
+    print("Analyzed {} games into {}".format(games, args.output))
+
+if __name__ == "__main__":
+    main()
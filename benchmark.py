@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+import argparse
+import time
+import gameengine
+from gameengine import Difficulty
+from state import State
+
+# Search benchmark.
+#
+# Compares the time the minimax engine takes with different options. Games
+# are first played between plain HIGH AIs and recorded. Then every variant
+# has its AIs choose every move of the recorded games, which are played on
+# as recorded, so that all variants search the same positions. The best
+# time of a number of repeats is printed for every variant, together with
+# the number of nodes searched.
+#
+# Example: python3 benchmark.py --variants plain symmetric --games 12 --repeats 3
+
+# AI options of the variants, see gameengine.AI
+VARIANTS = {"plain": {},
+            "symmetric": {"symmetric": True},
+            "batch": {"batch_leaves": True}}
+
+# Plays games between plain HIGH AIs, and returns their moves
+def record_games(games):
+    records = []
+    for g in range(games):
+        gameengine.seed(g)
+        ais = [gameengine.AI(Difficulty.HIGH, book=None) for _ in range(2)]
+        state = State()
+        cp = 0
+        moves = []
+        while not state.has_winner() and not state.is_draw():
+            moves.append(ais[cp].choose_piece(state))
+            state.pick_piece(moves[-1])
+            cp ^= 1
+            moves.append(ais[cp].choose_square(state))
+            state.place_piece(*moves[-1])
+        records.append(moves)
+    return records
+
+# Has AIs with the given options choose every move of the recorded games.
+# Returns the seconds it took and the number of nodes searched.
+def replay_games(records, options):
+    elapsed = 0.0
+    nodes = 0
+    for g, moves in enumerate(records):
+        gameengine.seed(g)
+        ais = [gameengine.AI(Difficulty.HIGH, book=None, **options)
+               for _ in range(2)]
+        state = State()
+        cp = 0
+        for i, move in enumerate(moves):
+            ai = ais[cp]
+            start = time.perf_counter()
+            if i % 2 == 0:
+                ai.choose_piece(state)
+                state.pick_piece(move)
+                cp ^= 1
+            else:
+                ai.choose_square(state)
+                state.place_piece(*move)
+            elapsed += time.perf_counter() - start
+            nodes += ai.last_stats.nodes
+    return elapsed, nodes
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compares the search time of engine options.")
+    parser.add_argument("--variants", nargs="+", choices=VARIANTS,
+                        default=list(VARIANTS),
+                        help="variants to compare (default all)")
+    parser.add_argument("--games", type=int, default=10,
+                        help="number of games (default 10)")
+    parser.add_argument("--repeats", type=int, default=3,
+                        help="times every variant is timed (default 3)")
+    args = parser.parse_args()
+    variants = args.variants
+    records = record_games(args.games)
+    results = {variant: [] for variant in variants}
+    # Repeats are interleaved, so that a slow spell of the machine doesn't
+    # fall on a single variant
+    for _ in range(args.repeats):
+        for variant in variants:
+            results[variant].append(replay_games(records,
+                                                 VARIANTS[variant]))
+    for variant in variants:
+        print("{}: {:.3f} s, {} nodes".format(variant,
+                                              *min(results[variant])))
+
+if __name__ == "__main__":
+    main()
@@ -1,100 +1,15 @@
 #!/usr/bin/env python3
 
-import state
-import threading
+import gameplatform
+from gameplatform import Renderer
 
 
-class Game(object):
-    timeout = False
-    def __init__(self, player1=None, player2=None):
-        # Creates a new state with empty board and full pool of pieces
-        self._state = state.State()
-        # Keep player instances in array
-        self._players = [player1, player2]
-        # Current player's index in array
-        self._cp = 0
-        self._winner = None
-        self._loser = None
-
-    @property
-    def winner(self):
-        return self._winner
-
-    @property
-    def loser(self):
-        return self._loser
-
-    def start(self):
-        # Print initial state of board and pieces
-        GameIO.print_state(self._state)
-        while not self._game_over():
-            # Prompt player for piece
-            piece = self._players[self._cp].prompt_piece(self._state)
-            # Pick piece, modify state
-            self._state.pick_piece(piece)
-            # XOR to switch between players 0 and 1
-            self._cp ^= 1
-            # Prompt player for square
-            row, col = self._players[self._cp].prompt_square(self._state)
-            # Place piece, modify state
-            self._state.place_piece(row, col)
-            # Print board and pieces
-
-    def timeout_occured(self):
-        self.timeout = True
-    def start_with_timer(self, timeout_time):
-        # Print initial state of board and pieces
-        GameIO.print_state(self._state)
-        while not self._game_over() and not self.timeout:
-            # Prompt player for piece
-            my_timer = threading.Timer(timeout_time, self.timeout_occured)
-            my_timer.start()
-    
-            piece = self._players[self._cp].prompt_piece(self._state)
-            my_timer.cancel()
-            
-            # Pick piece, modify state
-            self._state.pick_piece(piece)
-            # XOR to switch between players 0 and 1
-            self._cp ^= 1
-            # Prompt player for square
-            my_timer = threading.Timer(timeout_time, self.timeout_occured)
-            my_timer.start()
-
-            row, col = self._players[self._cp].prompt_square(self._state)
-            my_timer.cancel()
-
-            # Place piece, modify state
-            self._state.place_piece(row, col)
-            # Print board and pieces
-            GameIO.print_state(self._state)
-            GameIO.print_state(self._state)
-        if self.timeout:
-            return "Timeout"
-        else:
-            return "Game Over"
-
-    def reset(self):
-        self._state = state.State()
-        self._cp = 0
-        self._winner = None
-        self._loser = None
-    
-    def get_winner(self):
-        if not self._state.is_draw():
-            return self._winner.name
-        return False
-    
-    def _game_over(self):
-        if self._state.has_winner():
-            self._winner = self._players[self._cp]
-            self._loser = self._players[self._cp ^ 1]
-            GameIO.print_winner(self._winner.name)
-            return True
-        if self._state.is_draw():
-            GameIO.print_draw()
-            return True
-        return False
+# A game printed in the binary notation of GameIO. It is played like
+# gameplatform.Game, which does the moves, the clock and the time-outs.
+class Game(gameplatform.Game):
+    def __init__(self, player1=None, player2=None, renderer=None):
+        super().__init__(player1, player2, renderer=renderer
+                         if renderer is not None else ConsoleRenderer())
 
 class GameIO(object):
     @classmethod
@@ -126,3 +41,26 @@ class GameIO(object):
         for piece in pieces:
             print(format(piece, '04b'), end=" ")
         print("}")
+
+# Prints the game to the terminal in the binary notation of GameIO
+class ConsoleRenderer(Renderer):
+    def state(self, state):
+        GameIO.print_state(state)
+
+    def piece_chosen(self, name, piece):
+        print("{} chose piece {}".format(name, format(piece, '04b')))
+
+    def square_chosen(self, name, row, col):
+        print("{} chose square {}{}".format(name, row+1, "ABCD"[col]))
+
+    def waiting(self, name, what):
+        print("Waiting for opponent {} to choose a {}...".format(name, what))
+
+    def message(self, text):
+        print(text)
+
+    def winner(self, name):
+        GameIO.print_winner(name)
+
+    def draw(self):
+        GameIO.print_draw()
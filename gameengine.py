@@ -1,53 +1,474 @@
 #!/usr/bin/env python3
 
 import random
-from functools import reduce
-from math import inf
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+from math import gcd, inf, log, sqrt
+from state import State, _LINES
+from symmetry import canonical_form, to_canonical_move, from_canonical_move
+import openingbook
+import tablebase
+
+# NumPy is optional, it is only used to evaluate leaves and play out games
+# in batches. It takes far longer to import than the rest of the engine, so
+# it is only imported when first needed, see _numpy().
+np = None
+_numpy_imported = False
+
+# Returns the NumPy module, importing it on first use, or None if it is not
+# installed
+def _numpy():
+    global np, _numpy_imported, _SQUARE_IN_LINE, _PLACE_MASKS, \
+        _LINE_VALUE_ARRAY
+    if not _numpy_imported:
+        try:
+            import numpy as np
+        except ImportError:
+            np = None
+        else:
+            # Lines through each square, as a (16, 10) boolean array, and
+            # the masks of line summaries for placing each piece (see
+            # AbsState.line_summaries()), for _playouts_batch
+            _SQUARE_IN_LINE = np.array([[sq in line for line in _LINES]
+                                        for sq in range(16)])
+            _PLACE_MASKS = np.array([0xF00 | p << 4 | (0b1111 - p)
+                                     for p in range(16)])
+            # _LINE_VALUES as an array, for evaluate_batch
+            _LINE_VALUE_ARRAY = np.array(_LINE_VALUES)
+        _numpy_imported = True
+    return np
 
 class Difficulty:
     LOW = 1
     MEDIUM = 2
     HIGH = 3
 
+# Search algorithms an AI player can use: AI (minimax) or MCTS
+class Engine:
+    MINIMAX = 1
+    MCTS = 2
+
+# Seeds the random numbers the engines play by, so that games with the
+# same seed and players are played the same way
+def seed(value):
+    random.seed(value)
+    if _numpy() is not None:
+        np.random.seed(value % 2**32)
+
+# Most of the remaining clock time a single move may take
+_max_clock_share = 0.5
+
+# Returns the seconds to spend on the next move of the state when playing on
+# a clock, with remaining seconds left and increment seconds added after
+# each move: an even share of the remaining time among the moves the player
+# has left (a pick and a placement per piece, taking turns with the
+# opponent), plus the increment.
+def clock_budget(state, remaining, increment=0):
+    moves_left = max(1, (2*len(state.pieces) + state.is_holding() + 1) // 2)
+    return min(remaining*_max_clock_share, remaining/moves_left + increment)
+
+# Sort keys for search results (value, depth), where depth is the remaining
+# depth at which the value was found, so larger depth values == shallower.
+# Among equal values, wins (positive values) are better when shallower, and
+# losses, draws and other values better when deeper, i.e. quick wins and
+# slow losses are preferred.
+def _rank(val, depth):
+    return (val, depth) if val > 0 else (val, -depth)
+
+_LOWEST = (-inf, -inf)
+_HIGHEST = (inf, inf)
+_FULL_WINDOW = (_LOWEST, _HIGHEST)
+
+# Kinds of values stored in transposition tables
+_EXACT, _LOWER, _UPPER = 0, 1, 2
+
+# Raised inside the search when the time or node budget of a move runs out
+class _SearchAborted(Exception): pass
+
+# Statistics of the search for one move, see AI.last_stats.
+# source is where the move came from: "search", "book" (opening book),
+# "principal" (the piece of the previous square search, see
+# AI._calc_best_piece) or "random" (the AI's difficulty made it play a
+# random move). With worker processes, only nodes includes the workers'
+# share.
+class SearchStats(object):
+    def __init__(self, source="search"):
+        self.source = source
+        # Nodes searched
+        self.nodes = 0
+        # Leaves evaluated with the static evaluation
+        self.leaves = 0
+        self.can_win_calls = 0
+        # Transposition table lookups, and those that gave a usable result
+        self.cache_probes = 0
+        self.cache_hits = 0
+        self.tablebase_hits = 0
+        # Seconds the move took
+        self.elapsed = 0.0
+        # Depth of the deepest completed search
+        self.depth = 0
+
+    @property
+    def nodes_per_second(self):
+        return self.nodes / self.elapsed if self.elapsed > 0 else 0.0
+
+    def as_dict(self):
+        stats = dict(vars(self))
+        stats["nodes_per_second"] = self.nodes_per_second
+        return stats
+
 class AI(object):
+    # Max number of entries in each transposition table before it is cleared
+    _tt_max_size = 1 << 18
+    # Share of a move's time limit the search may use, the rest is left for
+    # stopping the search and returning the move
+    _time_safety = 0.9
+    # Number of nodes searched between checks of the budget
+    _check_interval = 256
+    # Least number of remaining pieces for choose_moves to group positions
+    # by symmetry
+    _batch_canonical_pieces = 6
+    # Least number of remaining pieces for symmetric search to key a node on
+    # its canonical form. Nodes with fewer are cheap to search and rarely
+    # met again in another orientation, so they keep their Zobrist key.
+    # Canonical keys have bits set above the 64 bits of Zobrist keys, so
+    # both can share the tables.
+    _symmetric_pieces = 8
+
     # Constructor
-    def __init__(self, difficulty):
+    # With symmetric=True, the transposition tables are keyed on the
+    # canonical form of positions instead of their Zobrist key, so that one
+    # entry serves all symmetric variants of a position, at the cost of
+    # canonicalizing the searched nodes (see _symmetric_pieces).
+    # With a time_limit (seconds per move) or node_limit (nodes per move),
+    # the search is iteratively deepened until the budget runs out, and the
+    # move from the deepest completed iteration is played. Otherwise the
+    # search depth is fixed by the number of remaining pieces.
+    # With a tablebase (see tablebase.py), positions found in it are not
+    # searched, their exact values are used instead.
+    # With workers > 1, the moves at the root are split among that many
+    # worker processes (see _parallel_maximize).
+    # The opening book at book (see openingbook.py) is played from when it
+    # has the position, book=None turns it off.
+    # With batch_leaves=True and NumPy installed, the children of depth 1
+    # nodes are evaluated together with evaluate_batch (see
+    # _leaf_children). It is off by default, as it is no faster than
+    # evaluating them one by one at the branching factors of Quarto, see
+    # benchmark.py.
+    def __init__(self, difficulty, symmetric=False,
+                 time_limit=None, node_limit=None, tablebase=None,
+                 workers=None, book=openingbook.DEFAULT_PATH,
+                 batch_leaves=False):
         self._difficulty_smartness = [0, 0.5, 1.1][difficulty-1]
+        self._symmetric = symmetric
+        self._batch_leaves = batch_leaves
+        self._tablebase = tablebase
+        self._book = book
+        self._workers = workers if workers and workers > 1 else None
+        self._time_limit = time_limit
+        self._node_limit = node_limit
+        # Transposition tables for max and min nodes, mapping the state's
+        # key to (value, depth offset, depth searched, best move, bound).
+        # Kept across moves, as later searches revisit the same positions.
+        self._max_table = {}
+        self._min_table = {}
+        # Budget of the current search, see _visit
+        self._nodes = 0
+        self._limited = False
+        self._deadline = None
+        # Background search during the opponent's turn, see ponder
+        self._ponder_thread = None
+        self._ponder_stop = None
+        # Statistics of the current search, and of the last move made
+        self._stats = SearchStats()
+        self.last_stats = None
+        # (key, piece) of the principal move of the last square search, see
+        # _calc_best_piece
+        self._principal = None
     
-    def choose_piece(self, state):
+    # A time_limit given here is the most time the move may take. It caps
+    # the one given to the constructor, and an AI without a budget of its
+    # own still searches to its usual depth, but stops early if that would
+    # take longer.
+    def choose_piece(self, state, time_limit=None):
         if random.random() < self._difficulty_smartness:
-            return self._calc_best_piece(state)
+            return self._calc_best_piece(state, time_limit)
         else:
+            self.last_stats = SearchStats("random")
             return self._random_piece(state)
         
-    def choose_square(self, state):
+    def choose_square(self, state, time_limit=None):
+        self._principal = None
         if random.random() < self._difficulty_smartness:
-            return self._calc_best_square(state)
+            return self._calc_best_square(state, time_limit)
         else:
+            self.last_stats = SearchStats("random")
             return self._random_square(state)
         
+    # Chooses moves for many positions at once, e.g. of games played side
+    # by side. Returns a list with, for each state, a piece as returned by
+    # choose_piece if it holds no piece, and a square as returned by
+    # choose_square otherwise. Positions that are symmetric to each other
+    # (see symmetry.py) are searched once, and all of them share the
+    # opening book and transposition tables, so this is faster than
+    # choosing the moves one by one. time_limit is per searched position.
+    def choose_moves(self, states, time_limit=None):
+        moves = [None]*len(states)
+        # Searched positions by key, with the indices of the states equal
+        # to them and the transformations that map those states there
+        groups = {}
+        for i, state in enumerate(states):
+            if random.random() < self._difficulty_smartness:
+                key, transform = self._batch_key(state)
+                groups.setdefault(key, []).append((i, transform))
+            elif state.is_holding():
+                moves[i] = self._random_square(state)
+            else:
+                moves[i] = self._random_piece(state)
+        for members in groups.values():
+            i, transform = members[0]
+            move = self._search(states[i], time_limit)
+            if transform is not None:
+                move = to_canonical_move(move, *transform)
+            for j, transform in members:
+                square, piece = (from_canonical_move(move, *transform)
+                                 if transform is not None else move)
+                moves[j] = square if states[j].is_holding() else piece
+        return moves
+
+    # Searches the state with the full window, to the given depth, or to
+    # the usual depth for the state (see _determine_depth) but at most
+    # max_depth. Returns (best value, best move, value of move), from the
+    # point of view of the player to move, where move is a (square, piece)
+    # pair as played from the state. The value of move is searched to the
+    # same depth as the best move, and is None if no move is given. The
+    # state is not modified.
+    def evaluate_move(self, state, move=None, depth=None, max_depth=inf):
+        self.stop_pondering()
+        node = state.copy()
+        if depth is None:
+            depth = min(self._determine_depth(node), max_depth)
+        best_val, _, best_move = self._maximize(node, depth)
+        if move is None:
+            return best_val, best_move, None
+        if move == best_move:
+            return best_val, best_move, best_val
+        self._make(node, move)
+        move_val, _, _ = self._minimize(node, depth-1)
+        return best_val, best_move, move_val
+
+    # Positions are keyed on their canonical form, so that symmetric ones
+    # are searched once. With only a few pieces left, searches are cheap
+    # and mostly answered by the transposition tables, and canonicalizing
+    # costs more than it saves, so only equal positions are grouped, by
+    # their Zobrist key.
+    def _batch_key(self, state):
+        if len(state.pieces) < self._batch_canonical_pieces:
+            return (False, state.key), None
+        key, sym, pmap = canonical_form(state)
+        return (True, key), (sym, pmap)
+
     def _random_piece(self, state):
         return random.choice(list(state.pieces))        
 
     def _random_square(self, state):
         return random.choice(state.free_squares())
 
+    # With alpha-beta, depth 2 is affordable from the first move, and the
+    # game is searched to the end once 6 pieces remain.
     def _determine_depth(self, state):
         rem_pieces = len(state.pieces)
-        if   rem_pieces >= 12: return 1
-        elif rem_pieces >=  9: return 2
-        elif rem_pieces >=  6: return 3
-        return 4
+        if   rem_pieces >=  9: return 2
+        elif rem_pieces >=  8: return 3
+        elif rem_pieces >=  7: return 4
+        return rem_pieces + 1
     
-    def _calc_best_piece(self, state):
-        _, _, (_, p) = self._maximize(state, self._determine_depth(state))
+    # A square search finds the best (square, piece) pair, and the same
+    # player picks a piece right after placing, so the piece is kept along
+    # with the key of the position after placing. If the piece search is
+    # for that very position, the piece is played without searching again.
+    def _calc_best_piece(self, state, time_limit=None):
+        principal, self._principal = self._principal, None
+        if principal is not None and principal[0] == state.key:
+            self.last_stats = SearchStats("principal")
+            return principal[1]
+        _, p = self._search(state, time_limit)
         return p
     
-    def _calc_best_square(self, state):
-        _, _, (s, _) = self._maximize(state, self._determine_depth(state))
+    def _calc_best_square(self, state, time_limit=None):
+        s, p = self._search(state, time_limit)
+        if p is not None:
+            after = state.copy()
+            after.place_piece(*s)
+            if not after.has_winner():
+                self._principal = (after.key, p)
         return s
 
-    def _maximize(self, node, depth):
+    # The search walks the tree in place on a single copy of the state,
+    # making and taking back moves with push_*/undo, so that the caller's
+    # state is never modified and no state is copied per node.
+    # Returns the best move found, as a (square, piece) pair, and keeps the
+    # statistics of the search in last_stats.
+    def _search(self, state, time_limit=None):
+        self.stop_pondering()
+        self._stats = SearchStats()
+        start = time.monotonic()
+        move = self._find_move(state, time_limit)
+        self._stats.elapsed = time.monotonic() - start
+        self._stats.nodes = self._nodes
+        self.last_stats = self._stats
+        return move
+
+    def _find_move(self, state, time_limit):
+        self._nodes = 0
+        if self._book is not None:
+            move = openingbook.lookup(state, self._book)
+            if move is not None:
+                self._stats.source = "book"
+                return move
+        node = state.copy()
+        if self._time_limit is None and self._node_limit is None:
+            max_depth = self._determine_depth(state)
+            if time_limit is None:
+                self._stats.depth = max_depth
+                return self._root(node, max_depth)[2]
+        else:
+            max_depth = len(state.pieces) + 1
+            if self._time_limit is not None:
+                time_limit = min(time_limit or inf, self._time_limit)
+        self._deadline = (time.monotonic() + time_limit*self._time_safety
+                          if time_limit is not None else None)
+        # Depth 1 is always completed, so that there is a move to return
+        move = None
+        try:
+            for depth in range(1, max_depth + 1):
+                val, _, move = self._root(node, depth)
+                self._stats.depth = depth
+                # Wins and losses are exact, deeper searches won't change them
+                if val in (inf, -inf):
+                    break
+                self._limited = True
+        except _SearchAborted:
+            pass
+        finally:
+            self._limited = False
+        return move
+
+    def _root(self, node, depth):
+        if self._workers is None:
+            return self._maximize(node, depth)
+        return self._parallel_maximize(node, depth)
+
+    # Same as _maximize at the root, but the root moves are dealt out to the
+    # worker processes, which search their share with alpha-beta on their
+    # own. Each worker returns its best move, and the best of those is
+    # picked. The position is sent in the compact form of pack_position.
+    # Workers keep their AI, and so their transposition tables, between
+    # searches. Raises _SearchAborted if any worker ran out of budget.
+    def _parallel_maximize(self, node, depth):
+        moves = list(self._search_moves(node, depth))
+        position = pack_position(node)
+        node_limit = None
+        if self._node_limit is not None:
+            node_limit = max(self._node_limit - self._nodes, 0)
+            node_limit //= self._workers
+        options = (self._symmetric, self._batch_leaves,
+                   self._tablebase.path if self._tablebase else None)
+        budget = (self._limited, self._deadline, node_limit)
+        # Dealt round robin, so every worker gets some of the moves that
+        # ordering put first
+        chunks = [moves[i::self._workers] for i in range(self._workers)]
+        pool = _worker_pool(self._workers)
+        futures = [pool.submit(_search_root_moves, position, chunk, depth,
+                               options, budget)
+                   for chunk in chunks if chunk]
+        results = [future.result() for future in futures]
+        self._nodes += sum(nodes for _, nodes in results)
+        if any(best is None for best, _ in results):
+            raise _SearchAborted()
+        return self._max([best for best, _ in results])
+
+    # Called for every searched node. Raises _SearchAborted when the budget
+    # runs out, or pondering is stopped, which is checked every
+    # _check_interval nodes.
+    def _visit(self):
+        self._nodes += 1
+        if (self._limited and not self._nodes % self._check_interval and
+                self._out_of_budget()):
+            raise _SearchAborted()
+
+    def _out_of_budget(self):
+        if self._ponder_stop is not None:
+            return self._ponder_stop.is_set()
+        return ((self._node_limit is not None and
+                 self._nodes >= self._node_limit) or
+                (self._deadline is not None and
+                 time.monotonic() >= self._deadline))
+
+    # Starts searching the replies of the opponent in the background, with
+    # the opponent to place the held piece of state, until stop_pondering
+    # is called. The results are kept in the transposition tables, so that
+    # when the opponent's move is one that was searched, the next search
+    # finds its result there right away. Must be stopped before the AI is
+    # asked for a move again.
+    def ponder(self, state):
+        self.stop_pondering()
+        self._stats = SearchStats()
+        self._ponder_stop = threading.Event()
+        self._ponder_thread = threading.Thread(target=self._ponder,
+                                               args=(state.copy(),),
+                                               daemon=True)
+        self._ponder_thread.start()
+
+    # Stops pondering, if started, and waits for the search to stop
+    def stop_pondering(self):
+        if self._ponder_thread is None:
+            return
+        self._ponder_stop.set()
+        self._ponder_thread.join()
+        self._ponder_thread = None
+        self._ponder_stop = None
+
+    # Searches the positions after the opponent's replies with the same
+    # full window and depth as _search would, best replies for the
+    # opponent first (by a static look at them), and then deeper for as
+    # long as it is allowed to run.
+    def _ponder(self, node):
+        self._nodes = 0
+        self._deadline = None
+        self._limited = True
+        try:
+            replies = sorted(self._moves(node),
+                             key=lambda move: self._reply_rank(node, move))
+            for extra in range(len(node.pieces) + 1):
+                deeper = False
+                for reply in replies:
+                    self._make(node, reply)
+                    if not node.has_winner() and not node.is_draw():
+                        depth = self._determine_depth(node) + extra
+                        if depth <= len(node.pieces) + 1:
+                            self._maximize(node, depth)
+                            deeper = True
+                    self._unmake(node, reply)
+                if not deeper:
+                    break
+        except _SearchAborted:
+            pass
+        finally:
+            self._limited = False
+
+    def _reply_rank(self, node, move):
+        self._make(node, move)
+        rank = _rank(*self._maximize(node, 0)[:2])
+        self._unmake(node, move)
+        return rank
+
+    # Alpha-beta search. Values are compared by their rank (see _rank), so
+    # that alpha and beta carry the depth-aware tie-breaking as well.
+    def _maximize(self, node, depth, alpha=_LOWEST, beta=_HIGHEST):
+        self._visit()
         if node.has_winner():
             return -inf, depth, None
         if node.is_draw():
@@ -56,13 +477,38 @@ class AI(object):
             if self._can_win(node):
                 return inf, depth, None
             return self._evaluate(node), 0, None
-        vals = []
-        for child, move in self._children(node):
-            cval, cdepth, _ = self._minimize(child, depth-1)
-            vals.append((cval, cdepth, move))
-        return self._max(vals)
+        known = self._probe_tablebase(node, depth, True)
+        if known is not None:
+            return known
+        key, transform = self._table_key(node)
+        hit, hint = self._probe(self._max_table, key, transform, depth,
+                                alpha, beta)
+        if hit is not None:
+            return hit
+        if (self._batch_leaves and depth == 1 and
+                (alpha, beta) == _FULL_WINDOW and _numpy() is not None):
+            best = self._max(self._leaf_children(node, False))
+        else:
+            best, best_rank, a = None, _LOWEST, alpha
+            # Nothing beats winning with the next move, so once such a
+            # move is found, the rest are not generated
+            quickest_win = _rank(inf, depth-1)
+            for move in self._search_moves(node, depth, hint):
+                self._make(node, move)
+                cval, cdepth, _ = self._minimize(node, depth-1, a, beta)
+                self._unmake(node, move)
+                rank = _rank(cval, cdepth)
+                if rank > best_rank:
+                    best, best_rank = (cval, cdepth, move), rank
+                    if rank >= beta or rank == quickest_win:
+                        break
+                    if rank > a:
+                        a = rank
+        return self._store(self._max_table, key, transform, depth, best,
+                           alpha, beta)
 
-    def _minimize(self, node, depth):
+    def _minimize(self, node, depth, alpha=_LOWEST, beta=_HIGHEST):
+        self._visit()
         if node.has_winner():
             return inf, depth, None
         if node.is_draw():
@@ -73,79 +519,543 @@ class AI(object):
             if self._can_win(node):
                 return -inf, depth, None
             return self._evaluate(node), 0, None
-        vals = []
-        for child, move in self._children(node):
-            cval, cdepth, _ = self._maximize(child, depth-1)
-            vals.append((cval, cdepth, move))
-        return self._min(vals)
+        known = self._probe_tablebase(node, depth, False)
+        if known is not None:
+            return known
+        key, transform = self._table_key(node)
+        hit, hint = self._probe(self._min_table, key, transform, depth,
+                                alpha, beta)
+        if hit is not None:
+            return hit
+        if (self._batch_leaves and depth == 1 and
+                (alpha, beta) == _FULL_WINDOW and _numpy() is not None):
+            best = self._min(self._leaf_children(node, True))
+        else:
+            best, best_rank, b = None, _HIGHEST, beta
+            quickest_win = _rank(-inf, depth-1)
+            for move in self._search_moves(node, depth, hint):
+                self._make(node, move)
+                cval, cdepth, _ = self._maximize(node, depth-1, alpha, b)
+                self._unmake(node, move)
+                rank = _rank(cval, cdepth)
+                if rank < best_rank:
+                    best, best_rank = (cval, cdepth, move), rank
+                    if rank <= alpha or rank == quickest_win:
+                        break
+                    if rank < b:
+                        b = rank
+        return self._store(self._min_table, key, transform, depth, best,
+                           alpha, beta)
+
+    # Looks the node up in the tablebase, and returns its exact value as a
+    # search result, or None if it is not there. The depth of the result is
+    # that at which the search itself would find the value: at the node
+    # where the game ends for a win by max or a draw, and one level up for
+    # a win by min, as min's wins are found by _can_win before placing.
+    def _probe_tablebase(self, node, depth, maximizing):
+        if (self._tablebase is None or
+                len(node.pieces) > self._tablebase.max_pieces):
+            return None
+        found = self._tablebase.probe(node)
+        if found is None:
+            return None
+        self._stats.tablebase_hits += 1
+        result, distance, move = found
+        if result == tablebase.DRAW:
+            return 0, depth - distance, move
+        if (result == tablebase.WIN) == maximizing:
+            return inf, depth - distance, move
+        return -inf, depth - distance + 1, move
+
+    # Returns the transposition table key of the node, and the symmetry
+    # transformation that maps the node onto the canonical position (None
+    # if keyed on the Zobrist key). Moves are stored in the canonical
+    # position's orientation.
+    def _table_key(self, node):
+        if (not self._symmetric or
+                len(node.pieces) < self._symmetric_pieces):
+            return node.key, None
+        key, sym, pmap = canonical_form(node)
+        return key, (sym, pmap)
+
+    # Depths returned by the search are remaining depths at the node where
+    # the value was found, so entries store them relative to the node's
+    # depth, and they are translated back on lookup. An entry is only used
+    # if it was searched at least as deep as requested, and if its value is
+    # exact or a bound that falls outside the (alpha, beta) window.
+    # Returns (result, hint), where result is the usable search result or
+    # None, and hint is the best move of any entry found (e.g. from the
+    # previous iteration of iterative deepening), to be searched first.
+    def _probe(self, table, key, transform, depth, alpha, beta):
+        self._stats.cache_probes += 1
+        entry = table.get(key)
+        if entry is None:
+            return None, None
+        val, offset, searched, move, bound = entry
+        if transform is not None and move is not None:
+            move = from_canonical_move(move, *transform)
+        rank = _rank(val, depth - offset)
+        if (searched < depth or
+                (bound == _LOWER and rank < beta) or
+                (bound == _UPPER and rank > alpha)):
+            return None, move
+        self._stats.cache_hits += 1
+        return (val, depth - offset, move), move
+
+    def _store(self, table, key, transform, depth, result, alpha, beta):
+        if len(table) >= self._tt_max_size:
+            table.clear()
+        val, vdepth, move = result
+        rank = _rank(val, vdepth)
+        bound = (_UPPER if rank <= alpha else
+                 _LOWER if rank >= beta else _EXACT)
+        if transform is not None and move is not None:
+            move = to_canonical_move(move, *transform)
+        table[key] = (val, depth - vdepth, depth, move, bound)
+        return result
 
+    # Same as calling _maximize/_minimize with depth 0 on every child of the
+    # node, but the children that need a static evaluation are evaluated
+    # together with evaluate_batch. Requires NumPy.
+    def _leaf_children(self, node, maximizing):
+        vals, pending, lines = [], [], []
+        for move in self._moves(node):
+            self._make(node, move)
+            if node.has_winner():
+                vals.append((-inf if maximizing else inf, 0, move))
+            elif node.is_draw():
+                vals.append((0, 0, move))
+            elif self._can_win(node):
+                vals.append((inf if maximizing else -inf, 0, move))
+            else:
+                pending.append((len(vals), move))
+                lines.append(node.line_summaries())
+                vals.append(None)
+            self._unmake(node, move)
+        if lines:
+            self._stats.leaves += len(lines)
+            scores = evaluate_batch(np.array(lines)).tolist()
+            for (i, move), score in zip(pending, scores):
+                vals[i] = (score, 0, move)
+        return vals
+
+    # The first of the best values is picked, as the moves are shuffled
     def _max(self, vals):
-        # Note: in our case, larger depth values == shallower
-        val, depth, move = -inf, None, None
-        for v, d, m in vals:
-            if (v > val or
-                    (v == val and v > 0 and (depth is None or d > depth)) or
-                    (v == val and v <= 0 and (depth is None or d < depth))):
-                val, depth, move = v, d, m
-        return val, depth, move
+        return max(vals, key=lambda val: _rank(val[0], val[1]))
 
     def _min(self, vals):
-        # Note: in our case, larger depth values == shallower
-        val, depth, move = inf, None, None
-        for v, d, m in vals:
-            if (v < val or
-                    (v == val and v > 0 and (depth is None or d < depth)) or
-                    (v == val and v <= 0 and (depth is None or d > depth))):
-                val, depth, move = v, d, m
-        return val, depth, move
-
-    def _children(self, state):
-        children = []
-        if not state.is_holding():
-            for piece in random.sample(state.pieces, len(state.pieces)):
-                child = state.copy()
-                child.pick_piece(piece)
-                children.append((child, (None, piece)))
-        elif not state.pieces:
-            free_squares = state.free_squares()
-            for row, col in random.sample(free_squares, len(free_squares)):
-                child = state.copy()
-                child.place_piece(row, col)
-                children.append((child, ((row, col), None)))
-        else:
-            free_squares = state.free_squares()
-            for row, col in random.sample(free_squares, len(free_squares)):
-                temp = state.copy()
-                temp.place_piece(row, col)
-                for piece in random.sample(state.pieces, len(state.pieces)):
-                    child = temp.copy()
-                    child.pick_piece(piece)
-                    children.append((child, ((row, col), piece)))
-        return children
+        return min(vals, key=lambda val: _rank(val[0], val[1]))
 
-    def _can_win(self, state):
+    # Generates the moves available in the state, in random order, as
+    # (square, piece) pairs where either may be None. Moves are generated
+    # one at a time, so a search that cuts off early doesn't pay for the
+    # rest.
+    def _moves(self, state):
+        pieces = sorted(state.pieces)
         if not state.is_holding():
+            return ((None, pieces[i]) for i in _shuffled(len(pieces)))
+        squares = state.free_squares()
+        if not pieces:
+            return ((squares[i], None) for i in _shuffled(len(squares)))
+        n = len(pieces)
+        return ((squares[i // n], pieces[i % n])
+                for i in _shuffled(len(squares) * n))
+
+    # Ordering only pays off when the children have children of their own.
+    # Leaves are cheap to search, and can only be batch evaluated (which is
+    # done as long as no cutoff can happen) or cut off one by one.
+    # The hint is generated first, if it is a legal move.
+    def _search_moves(self, node, depth, hint=None):
+        moves = self._ordered_moves(node) if depth > 1 else self._moves(node)
+        if hint is None or not self._is_legal(node, hint):
+            return moves
+        return chain([hint], (move for move in moves if move != hint))
+
+    def _is_legal(self, state, move):
+        square, piece = move
+        if (square is not None) != state.is_holding():
+            return False
+        if square is not None and state.square(*square) is not None:
             return False
-        for row, col in state.free_squares():
-            child = state.copy()
-            child.place_piece(row, col)
-            if child.has_winner():
-                return True
-        return False
+        return piece in state.pieces or (piece is None and not state.pieces)
+
+    # Same moves as _moves, ordered to make alpha-beta cut off early:
+    # squares where the held piece wins come first (and with a single
+    # piece, since the game is over anyway). Pieces that let the opponent
+    # win right away are left out, as handing one over is the worst move
+    # there is. Only if every move does that, one of them is generated.
+    # The winning squares are found up front, the pieces of the other
+    # squares are filtered as they are reached.
+    def _ordered_moves(self, state):
+        pieces = sorted(state.pieces)
+        pieces = [pieces[i] for i in _shuffled(len(pieces))]
+        if not state.is_holding():
+            deadly = state.deadly_pieces()
+            safe = [p for p in pieces if not deadly >> p & 1]
+            yield from ((None, p) for p in safe or pieces[:1])
+            return
+        squares = state.free_squares()
+        others = []
+        for square in (squares[i] for i in _shuffled(len(squares))):
+            state.push_place(*square)
+            won = state.has_winner()
+            state.undo()
+            if won:
+                yield square, pieces[0] if pieces else None
+            else:
+                others.append(square)
+        any_safe = False
+        for square in others:
+            if not pieces:
+                yield square, None
+                continue
+            state.push_place(*square)
+            deadly = state.deadly_pieces()
+            state.undo()
+            for piece in pieces:
+                if not deadly >> piece & 1:
+                    any_safe = True
+                    yield square, piece
+        if others and pieces and not any_safe:
+            yield others[0], pieces[0]
+
+    def _make(self, state, move):
+        square, piece = move
+        if square is not None:
+            state.push_place(*square)
+        if piece is not None:
+            state.push_pick(piece)
+
+    def _unmake(self, state, move):
+        square, piece = move
+        if square is not None:
+            state.undo()
+        if piece is not None:
+            state.undo()
+
+    def _can_win(self, state):
+        self._stats.can_win_calls += 1
+        return (state.is_holding() and
+                bool(state.deadly_pieces() >> state.held_piece & 1))
     
     # Evaluates from the point of view of the maximizing player;
     # higher value means higher win potential
-    # Value for each vector is determined by how many attributes all pieces
-    # have in common and the number of pieces in the vector. The number of
-    # pieces in the vector weighs heavier than how many attributes the have in
-    # common, and is therefore squared in the calculation.
-    # (e.g. 2 pieces, 3 attributes in common -> val == 2^2 * 3 == 12)
-    # (e.g. 3 pieces, 2 attributes in common -> val == 3^2 * 2 == 18)
+    # The value of each line only depends on its summary (see
+    # AbsState.line_summaries()), and is looked up in _LINE_VALUES.
     def _evaluate(self, state):
-        vecs = [[p for p in v if p is not None] for v in state.get_vectors()]
-        return sum(map(lambda v: self._calc_common(v) * len(v)**2, vecs))
+        self._stats.leaves += 1
+        return sum(map(_LINE_VALUES.__getitem__, state.line_summaries()))
+
+
+# Strides coprime to n, by n, see _shuffled
+_strides = {}
+
+# Generates the integers 0 to n-1 in random order, as i -> (a*i + b) % n
+# with a random stride a coprime to n and a random offset b. This is a far
+# smaller family of permutations than a full shuffle, but it costs two
+# random numbers instead of a list, and is enough to vary the AI's play.
+def _shuffled(n):
+    if n == 0:
+        return iter(())
+    if n not in _strides:
+        _strides[n] = [a for a in range(1, n + 1) if gcd(a, n) == 1]
+    strides = _strides[n]
+    a = strides[random.randrange(len(strides))]
+    b = random.randrange(n)
+    return ((a*i + b) % n for i in range(n))
+
+# Worker pools by number of workers. Pools are kept for the life of the
+# program, so that processes are started once, not for every move or game.
+_pools = {}
+
+def _worker_pool(workers):
+    if workers not in _pools:
+        _pools[workers] = ProcessPoolExecutor(workers)
+    return _pools[workers]
+
+# AIs of a worker process, by their options, see _search_root_moves
+_worker_ais = {}
+_worker_tablebases = {}
+
+# Runs in a worker process. Searches the given root moves of the position
+# (see pack_position) with alpha-beta, and returns (best, nodes), where
+# best is the best search result among the moves, or None if the budget
+# ran out, and nodes the number of nodes searched.
+def _search_root_moves(position, moves, depth, options, budget):
+    if options not in _worker_ais:
+        symmetric, batch_leaves, tablebase_path = options
+        tb = None
+        if tablebase_path is not None:
+            if tablebase_path not in _worker_tablebases:
+                _worker_tablebases[tablebase_path] = \
+                    tablebase.Tablebase(tablebase_path)
+            tb = _worker_tablebases[tablebase_path]
+        _worker_ais[options] = AI(Difficulty.HIGH, symmetric=symmetric,
+                                  tablebase=tb, batch_leaves=batch_leaves)
+    ai = _worker_ais[options]
+    ai._limited, ai._deadline, ai._node_limit = budget
+    ai._nodes = 0
+    node = unpack_position(position)
+    best, best_rank, alpha = None, _LOWEST, _LOWEST
+    try:
+        for move in moves:
+            ai._make(node, move)
+            cval, cdepth, _ = ai._minimize(node, depth-1, alpha)
+            ai._unmake(node, move)
+            rank = _rank(cval, cdepth)
+            if rank > best_rank:
+                best, best_rank = (cval, cdepth, move), rank
+                alpha = max(alpha, rank)
+    except _SearchAborted:
+        best = None
+    finally:
+        ai._limited = False
+    return best, ai._nodes
+
+# Packs a state into 17 bytes: the 16 squares row by row, then the held
+# piece, with 16 for empty squares and no held piece. The remaining pieces
+# are the ones that are neither on the board nor held.
+def pack_position(state):
+    held = state.held_piece
+    return bytes(encode_board(state) + [16 if held is None else held])
+
+def unpack_position(position):
+    cells = [None if p == 16 else p for p in position]
+    board = [cells[4*r:4*r + 4] for r in range(4)]
+    pieces = set(range(16)) - set(cells)
+    return State(board, pieces, cells[16])
+
+# Number of 1 bits of every 4-bit integer
+_BIT_COUNTS = [bin(x).count('1') for x in range(16)]
+
+# Values of lines by their summaries, see AbsState.line_summaries().
+# Value for each line is determined by how many attributes all pieces
+# have in common and the number of pieces in the line. The number of
+# pieces in the line weighs heavier than how many attributes the have in
+# common, and is therefore squared in the calculation.
+# (e.g. 2 pieces, 3 attributes in common -> val == 2^2 * 3 == 12)
+# (e.g. 3 pieces, 2 attributes in common -> val == 3^2 * 2 == 18)
+_LINE_VALUES = [(s >> 8)**2 * _BIT_COUNTS[(s >> 4 | s) & 0b1111]
+                for s in range(5 << 8)]
+
+# Encodes the board of the state as a list of 16 integers, square by square,
+# with pieces as themselves and empty squares as 16.
+def encode_board(state):
+    squares = (state.square(r, c) for r in range(4) for c in range(4))
+    return [16 if p is None else p for p in squares]
+
+# Evaluates many positions at once, given as an (N, 10) NumPy array of
+# their line summaries (see AbsState.line_summaries()). Returns an array of
+# the N scores, equal to what AI._evaluate gives for each of them.
+def evaluate_batch(lines):
+    _numpy()
+    return _LINE_VALUE_ARRAY[lines].sum(axis=1)
+
+
+# Monte Carlo tree search (UCT). Instead of searching to a fixed depth and
+# evaluating with _evaluate, the tree is grown one node per iteration,
+# towards the moves that did best so far, and every new node is scored by
+# random playouts to the end of the game. It can be stopped at any time,
+# and plays better the more iterations it gets.
+class MCTS(object):
+    # Default number of iterations per move, by difficulty
+    _iterations_by_difficulty = [25, 150, 600]
+    # Exploration constant of UCT. Larger values spread iterations more
+    # evenly among moves, smaller ones focus on the best ones.
+    _exploration = 1.0
+
+    # Constructor
+    # iterations is the number of new nodes per move, and time_limit the
+    # most seconds per move, whichever runs out first. Each new node is
+    # scored by batch_size random playouts, played together in NumPy when
+    # it is installed.
+    def __init__(self, difficulty, iterations=None, time_limit=None,
+                 batch_size=32):
+        if iterations is None:
+            iterations = self._iterations_by_difficulty[difficulty-1]
+        self._iterations = iterations
+        self._time_limit = time_limit
+        self._batch_size = batch_size
+        # Statistics of the last move, as for AI. Nodes are the nodes added
+        # to the tree, leaves the playouts and depth the deepest node.
+        self.last_stats = None
+
+    # Same as AI.choose_piece/choose_square, time_limit caps the one given
+    # to the constructor.
+    def choose_piece(self, state, time_limit=None):
+        return self._search(state, time_limit)[1]
+
+    def choose_square(self, state, time_limit=None):
+        return self._search(state, time_limit)[0]
+
+    def _search(self, state, time_limit=None):
+        if self._time_limit is not None:
+            time_limit = min(time_limit or inf, self._time_limit)
+        deadline = (time.monotonic() + time_limit*AI._time_safety
+                    if time_limit is not None else None)
+        start = time.monotonic()
+        self._stats = SearchStats()
+        node = state.copy()
+        root = _TreeNode(None, _mcts_moves(node))
+        for _ in range(self._iterations):
+            self._iterate(root, node)
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+        self._stats.elapsed = time.monotonic() - start
+        self.last_stats = self._stats
+        return max(root.children, key=lambda child: child.visits).move
+
+    # Selects a path down the tree with UCT, expands one new node at its
+    # end, scores it with playouts and adds the result to every node on the
+    # path. The node is the root's state, walked in place with push/undo.
+    def _iterate(self, root, node):
+        path, tree_node = [root], root
+        while not tree_node.untried and tree_node.children:
+            tree_node = self._select(tree_node)
+            _push_move(node, tree_node.move)
+            path.append(tree_node)
+        if tree_node.untried:
+            move = tree_node.untried.pop()
+            _push_move(node, move)
+            child = _TreeNode(move,
+                              [] if node.has_winner() or node.is_draw()
+                              else _mcts_moves(node))
+            tree_node.children.append(child)
+            path.append(child)
+            tree_node = child
+            self._stats.nodes += 1
+        self._stats.depth = max(self._stats.depth, len(path) - 1)
+        visits, score = self._score(node)
+        self._stats.leaves += visits
+        # score is for the player to move in the last node, which is not
+        # the one who moved into it, so it alternates up the path
+        for tree_node in reversed(path):
+            tree_node.visits += visits
+            tree_node.wins += visits - score
+            score = visits - score
+        for tree_node in reversed(path[1:]):
+            _undo_move(node, tree_node.move)
+
+    def _select(self, tree_node):
+        log_visits = log(tree_node.visits)
+        return max(tree_node.children,
+                   key=lambda child: child.wins / child.visits +
+                   self._exploration * sqrt(log_visits / child.visits))
+
+    # Returns (visits, score) of the node, where score is the sum of the
+    # results (1 for a win, 0.5 for a draw) of its playouts for the player
+    # to move. Games that are over count as one visit.
+    def _score(self, node):
+        if node.has_winner():
+            return 1, 0
+        if node.is_draw():
+            return 1, 0.5
+        if _numpy() is not None:
+            return self._batch_size, _playouts_batch(node, self._batch_size)
+        return self._batch_size, sum(_playout(node)
+                                     for _ in range(self._batch_size))
+
+class _TreeNode(object):
+    __slots__ = ('move', 'untried', 'children', 'visits', 'wins')
+
+    # wins is the sum of playout results for the player who made the move
+    # leading to the node
+    def __init__(self, move, untried):
+        self.move = move
+        self.untried = untried
+        self.children = []
+        self.visits = 0
+        self.wins = 0
+
+def _push_move(state, move):
+    square, piece = move
+    if square is not None:
+        state.push_place(*square)
+    if piece is not None:
+        state.push_pick(piece)
+
+def _undo_move(state, move):
+    square, piece = move
+    if square is not None:
+        state.undo()
+    if piece is not None:
+        state.undo()
+
+# Moves of the state in random order, in the same format as AI._moves.
+# Like in AI._ordered_moves, only a winning move is kept if there is one,
+# and moves that hand the opponent a winning piece are left out if there
+# are others, since random playouts are slow to notice either.
+def _mcts_moves(state):
+    pieces = sorted(state.pieces)
+    random.shuffle(pieces)
+    if not state.is_holding():
+        deadly = state.deadly_pieces()
+        return [(None, p) for p in
+                [p for p in pieces if not deadly >> p & 1] or pieces]
+    squares = state.free_squares()
+    random.shuffle(squares)
+    if not pieces:
+        return [(square, None) for square in squares]
+    safe, deadly_moves = [], []
+    for square in squares:
+        state.push_place(*square)
+        won = state.has_winner()
+        deadly = state.deadly_pieces()
+        state.undo()
+        if won:
+            return [(square, pieces[0])]
+        for p in pieces:
+            (deadly_moves if deadly >> p & 1 else safe).append((square, p))
+    return safe or deadly_moves
+
+# Plays random moves from the state to the end of the game. Returns the
+# result for the player to move: 1 for a win, 0.5 for a draw, 0 for a loss.
+def _playout(state):
+    node = state.copy()
+    pieces = sorted(node.pieces)
+    random.shuffle(pieces)
+    # Whether the next placement is made by the player to move in state,
+    # who places the held piece, or else picks a piece for the opponent
+    mine = node.is_holding()
+    while True:
+        if not node.is_holding():
+            if not pieces:
+                return 0.5
+            node.pick_piece(pieces.pop())
+        node.place_piece(*random.choice(node.free_squares()))
+        if node.has_winner():
+            return 1 if mine else 0
+        mine = not mine
 
-    def _calc_common(self, vec):
-        common = (reduce(lambda x, y: x & y, vec, 0b1111) | 
-                  reduce(lambda x, y: x & (0b1111 - y), vec, 0b1111))
-        return bin(common).count('1')
+# Same as summing _playout over n playouts, but all of them are played at
+# once, on arrays of their line summaries. Each playout is a random order
+# of the free squares and one of the remaining pieces, and step k places
+# the k:th piece on the k:th square, until a line is won.
+def _playouts_batch(state, n):
+    np = _numpy()
+    squares = np.array([4*r + c for r, c in state.free_squares()], dtype=int)
+    pieces = np.array(sorted(state.pieces), dtype=int)
+    holding = state.is_holding()
+    orders = np.argsort(np.random.random((n, len(squares))), axis=1)
+    square_seq = squares[orders]
+    piece_seq = pieces[np.argsort(np.random.random((n, len(pieces))),
+                                  axis=1)]
+    if holding:
+        piece_seq = np.hstack([np.full((n, 1), state.held_piece),
+                               piece_seq])
+    lines = np.tile(np.array(state.line_summaries()), (n, 1))
+    results = np.full(n, 0.5)
+    done = np.zeros(n, dtype=bool)
+    for k in range(len(squares)):
+        on_line = _SQUARE_IN_LINE[square_seq[:, k]]
+        placed = (lines + 0x100) & _PLACE_MASKS[piece_seq[:, k]][:, None]
+        lines = np.where(on_line, placed, lines)
+        won = ((on_line & (lines >= 0x400) & ((lines & 0xFF) != 0))
+               .any(axis=1) & ~done)
+        # The player to move places the held piece, and then every other
+        # piece. Without a held piece, the opponent places first.
+        results[won] = 1 if (k % 2 == 0) == holding else 0
+        done |= won
+        if done.all():
+            break
+    return float(results.sum())
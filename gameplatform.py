@@ -1,7 +1,12 @@
 #!/usr/bin/env python3
 
 from state import State
+import io
+import queue
 import threading
+import time
+import gameengine
+import gamerecord
 
 class GameCmd:
     QUIT = 'q'
@@ -9,18 +14,45 @@ class GameCmd:
 
 class GameStatusMsg:
     ERROR = "ERROR"
+
+# Raised when a player's time for a move runs out before the move is made
+class OutOfTimeException(Exception): pass
     
 class Game(object):
-    timeout = False
-    def __init__(self, player1=None, player2=None):
-        # Creates a new state with empty board and full pool of pieces
-        self._state = State()
+    def __init__(self, player1=None, player2=None, state_cls=State,
+                 renderer=None, record=None, seed=None, clock=None):
+        # Creates a new state with empty board and full pool of pieces.
+        # Any AbsState implementation can be used, e.g. state.BitState.
+        self._state_cls = state_cls
+        self._state = state_cls()
+        # All output of the game, and of its players, goes to the renderer.
+        # Defaults to printing to the terminal, see Renderer.
+        self._renderer = renderer if renderer is not None else \
+            ConsoleRenderer()
         # Keep player instances in array
         self._players = [player1, player2]
+        for player in self._players:
+            if player is not None:
+                player.renderer = self._renderer
         # Current player's index in array
         self._cp = 0
         self._winner = None
         self._loser = None
+        # With a record path, every game played is appended to that file,
+        # see gamerecord. With a seed, the random numbers of the AI are
+        # seeded with it at the start of every game, so games can be
+        # replayed exactly. Seeds range from 0 to gamerecord.MAX_SEED.
+        gamerecord.check_seed(seed)
+        self._record = record
+        self._seed = seed
+        # Moves of the game so far, in the format of gamerecord
+        self._moves = bytearray()
+        # With a clock (see Clock), the players play on it, and a player
+        # whose time runs out loses the game, which sets timeout
+        self._clock = clock
+        self.timeout = False
+        # Makes the moves while playing on the clock, see _Mover
+        self._mover = None
 
     @property
     def winner(self):
@@ -29,100 +61,159 @@ class Game(object):
     @property
     def loser(self):
         return self._loser
+
+    @property
+    def renderer(self):
+        return self._renderer
+
+    @property
+    def clock(self):
+        return self._clock
+
     def start_return(self):
-        # Print initial state of board and pieces
-        GameIO.print_welcome(self._players[0].name, self._players[1].name)
-        GameIO.print_state(self._state)
-        while not self._board_full():
-            # Prompt player for piece
-            piece = self._players[self._cp].prompt_piece(self._state)
-            # Pick piece, modify state
-            self._state.pick_piece(piece)
-            # XOR to switch between players 0 and 1
-            self._cp ^= 1
-            # Prompt player for square
-            row, col = self._players[self._cp].prompt_square(self._state)
-            # Place piece, modify state
-            self._state.place_piece(row, col)
-            # Print board and pieces
-            GameIO.print_state(self._state)
-        print()
-        return self._state._board
+        self._play(self._board_full)
+        return [list(row) for row in self._state.board]
         
     def start(self):
+        self._play(self._game_over)
+
+    # Plays the game until over() is true. The players are told the game is
+    # over even if it ends with an exception, e.g. when a player quits, so
+    # that they stop what they do in the background.
+    def _play(self, over):
+        self._begin_game()
         # Print initial state of board and pieces
-        GameIO.print_welcome(self._players[0].name, self._players[1].name)
-        GameIO.print_state(self._state)
-        while not self._game_over():
-            # Prompt player for piece
-            piece = self._players[self._cp].prompt_piece(self._state)
-            # Pick piece, modify state
-            self._state.pick_piece(piece)
-            # XOR to switch between players 0 and 1
-            self._cp ^= 1
-            # Prompt player for square
-            row, col = self._players[self._cp].prompt_square(self._state)
-            # Place piece, modify state
-            self._state.place_piece(row, col)
-            # Print board and pieces
-            GameIO.print_state(self._state)
-        print()
+        self._renderer.welcome(self._players[0].name, self._players[1].name)
+        self._renderer.state(self._state)
+        try:
+            while not over():
+                # Prompt player for piece
+                piece = self._prompt(self._players[self._cp].prompt_piece)
+                if self.timeout:
+                    break
+                # Pick piece, modify state
+                self._state.pick_piece(piece)
+                self._moves.append(piece)
+                # XOR to switch between players 0 and 1
+                self._cp ^= 1
+                # Prompt player for square
+                square = self._prompt(self._players[self._cp].prompt_square)
+                if self.timeout:
+                    break
+                # Place piece, modify state
+                row, col = square
+                self._state.place_piece(row, col)
+                self._moves.append(4*row + col)
+                # Print board and pieces
+                self._renderer.state(self._state)
+        finally:
+            self._stop_players()
+            if self._mover is not None:
+                self._mover.close()
+                self._mover = None
+        self._end_game()
         
-    def timeout_occured(self):
-        self.timeout = True
+    # Plays with a limit of timeout_time seconds per move, instead of the
+    # game's clock. A player whose move takes longer loses the game.
+    # Returns "Timeout" if that happened, "Game Over" otherwise.
     def start_with_timer(self, timeout_time):
-        # Print initial state of board and pieces
-        GameIO.print_state(self._state)
-        while not self._game_over() and not self.timeout:
-            # Prompt player for piece
-            my_timer = threading.Timer(timeout_time, self.timeout_occured)
-            my_timer.start()
-    
-            piece = self._players[self._cp].prompt_piece(self._state)
-            my_timer.cancel()
-            
-            # Pick piece, modify state
-            self._state.pick_piece(piece)
-            # XOR to switch between players 0 and 1
-            self._cp ^= 1
-            # Prompt player for square
-            my_timer = threading.Timer(timeout_time, self.timeout_occured)
-            my_timer.start()
-
-            row, col = self._players[self._cp].prompt_square(self._state)
-            my_timer.cancel()
-
-            # Place piece, modify state
-            self._state.place_piece(row, col)
-            # Print board and pieces
-            GameIO.print_state(self._state)
-            GameIO.print_state(self._state)
+        clock, self._clock = self._clock, Clock(timeout_time, per_move=True)
+        try:
+            self.start()
+        finally:
+            self._clock = clock
         if self.timeout:
             return "Timeout"
         else:
             return "Game Over"
 
+    # Asks the current player for a move with prompt, one of its prompt_*
+    # methods, on the clock if there is one. If the player's time runs out,
+    # the game is lost on time and the move is not played. The game stops
+    # waiting for the move then, even if the player is still on it.
+    def _prompt(self, prompt):
+        if self._clock is None:
+            return prompt(self._state)
+        remaining = self._clock.remaining(self._cp)
+        if self._clock.per_move:
+            args, kwargs = (self._state, remaining), {}
+        else:
+            args = (self._state,)
+            kwargs = {"clock": (remaining, self._clock.increment)}
+        if self._mover is None:
+            self._mover = _Mover()
+        self._clock.start(self._cp)
+        try:
+            move = self._mover.move(lambda: prompt(*args, **kwargs),
+                                    remaining)
+            timed_out = False
+        except OutOfTimeException:
+            move, timed_out = None, True
+            # The player may still be on the move
+            self._mover.close()
+            self._mover = None
+        if not self._clock.stop(timed_out):
+            self.timeout = True
+            self._winner = self._players[self._cp ^ 1]
+            self._loser = self._players[self._cp]
+            self._renderer.message("{} ran out of time."
+                                   .format(self._loser.name))
+            self._renderer.winner(self._winner.name)
+        return move
+
+    def _begin_game(self):
+        self._moves = bytearray()
+        self.timeout = False
+        if self._clock is not None:
+            self._clock.reset()
+        if self._seed is not None:
+            gameengine.seed(self._seed)
+
+    # Lets the players know the game is over
+    def _stop_players(self):
+        for player in self._players:
+            player.end_game()
+
+    # Lets the renderer know the game is over, and records the game
+    def _end_game(self):
+        self._renderer.end()
+        if self._record is not None:
+            # A loss on time can't be told from the moves
+            result = None
+            if self.timeout:
+                result = gamerecord.WIN_P1 \
+                    if self._winner is self._players[0] else \
+                    gamerecord.WIN_P2
+            gamerecord.append(self._record, gamerecord.GameRecord(
+                [p.name for p in self._players],
+                [p.difficulty for p in self._players],
+                self._seed, self._moves, result))
+
     def reset(self):
-        self._state = State()
+        self._state = self._state_cls()
+        self._moves = bytearray()
         self._cp = 0
         self._winner = None
         self._loser = None
+        self.timeout = False
+        if self._clock is not None:
+            self._clock.reset()
     
     def get_winner(self):
         if not self._state.is_draw():
             return self._winner.name
         return False
     def _board_full(self):
-        return (not self._state._pieces and
-                self._state._held_piece is None)
+        return (not self._state.pieces and
+                not self._state.is_holding())
     def _game_over(self):
         if self._state.has_winner():
             self._winner = self._players[self._cp]
             self._loser = self._players[self._cp ^ 1]
-            GameIO.print_winner(self._winner.name)
+            self._renderer.winner(self._winner.name)
             return True
         if self._state.is_draw():
-            GameIO.print_draw()
+            self._renderer.draw()
             return True
         return False
 
@@ -150,7 +241,7 @@ class GameIO(object):
     letter_to_col = dict(zip("ABCD", range(4)))
     col_to_letter = dict(zip(range(4), "ABCD"))
 
-    _game_view_str = """
+    game_view_str = """
        A       B       C       D
    +-------+-------+-------+-------+   PIECES LEFT:
    |       |       |       |       |    1. {016}
@@ -171,33 +262,220 @@ class GameIO(object):
    +-------+-------+-------+-------+   16. {031}
 """
 
-    _instructions = """
+    instructions = """
  - Enter number between 1-16 to choose piece from 'PIECES LEFT': '10' = {}.
  - Enter row and column to choose square: '2C'/'2c' = second row, third column.
  - Enter 'q' to forfeit the game and quit to the main menu.
  - Enter 'q!' to forfeit the game and close the application."""
 
-    @classmethod
-    def print_welcome(cls, p1_name, p2_name):
-        print("Welcome to the game between {} and {}!".format(p1_name, p2_name))
-        print()
-        print("Instructions:")
-        print(cls._instructions.format(GameIO.figures[9]))
-        print()
-        print("On your marks, get set, go!")
-
-    @classmethod
-    def print_state(cls, state):
-        board_figs = [cls.figures[col] for row in state.board for col in row]
+# Chess clock of a game. Each player has base seconds for the whole game,
+# and increment seconds are added after each of their moves (a pick or a
+# placement). The clock only runs during a move, between start() and
+# stop(), and a player whose remaining time runs out during a move loses
+# on time. The Game stops waiting for the move when that happens (see
+# _Mover), and players are handed what remains (see AbsPlayer.prompt_piece)
+# so that they can budget their time, or give up waiting for input.
+# With per_move=True, base is the limit of each move instead, and the time
+# left is reset after every move.
+class Clock(object):
+    def __init__(self, base, increment=0, per_move=False,
+                 timer=time.monotonic):
+        self._base = base
+        self._increment = increment
+        self._per_move = per_move
+        self._timer = timer
+        self.reset()
+
+    @property
+    def increment(self):
+        return self._increment
+
+    @property
+    def per_move(self):
+        return self._per_move
+
+    # Index of the player whose flag fell, or None
+    @property
+    def flagged(self):
+        return self._flagged
+
+    # Sets both players' time back to base
+    def reset(self):
+        self._remaining = [self._base, self._base]
+        self._running = None
+        self._started = None
+        self._flagged = None
+
+    # Returns the seconds player (0 or 1) has left, counting the current
+    # move if the player's clock is running
+    def remaining(self, player):
+        left = self._remaining[player]
+        if self._running == player:
+            left -= self._timer() - self._started
+        return max(left, 0)
+
+    def start(self, player):
+        self._running = player
+        self._started = self._timer()
+
+    # Stops the running clock. Returns False if the player's time ran out
+    # during the move, or timed_out is set as the move wasn't made in time.
+    def stop(self, timed_out=False):
+        player, self._running = self._running, None
+        left = self._remaining[player] - (self._timer() - self._started)
+        if left < 0 or timed_out:
+            self._remaining[player] = 0
+            self._flagged = player
+            return False
+        if self._per_move:
+            self._remaining[player] = self._base
+        else:
+            self._remaining[player] = left + self._increment
+        return True
+
+# Makes the moves of a game's players on a thread of its own, so that the
+# game can stop waiting for a move when the player's time runs out. The
+# same thread makes all moves of a game, unless one isn't made in time: as
+# the player may still be on it, the mover is closed, and its thread ends
+# once the move is done.
+class _Mover(object):
+    def __init__(self):
+        self._requests = queue.Queue()
+        thread = threading.Thread(target=self._run, daemon=True)
+        thread.start()
+
+    def _run(self):
+        while True:
+            request = self._requests.get()
+            if request is None:
+                return
+            call, results = request
+            try:
+                results.put((call(), None))
+            except BaseException as e:
+                results.put((None, e))
+
+    # Returns what call returns, or raises what it raises, or raises
+    # OutOfTimeException if it takes longer than timeout seconds
+    def move(self, call, timeout):
+        results = queue.Queue()
+        self._requests.put((call, results))
+        try:
+            move, error = results.get(timeout=timeout)
+        except queue.Empty:
+            raise OutOfTimeException()
+        if error is not None:
+            raise error
+        return move
+
+    def close(self):
+        self._requests.put(None)
+
+# Receives everything there is to show of a game: the board, the players'
+# moves and the outcome. The Game and its players only hand over the raw
+# state and moves, so building the text is up to the renderer, and a game
+# without anyone watching pays nothing for it.
+#
+# This base class shows nothing. Subclasses override what they show.
+class Renderer(object):
+    # The game between the named players starts
+    def welcome(self, p1_name, p2_name):
+        pass
+
+    # The board and the pieces left, after every placement
+    def state(self, state):
+        pass
+
+    # The named player picked piece (0-15) for the opponent
+    def piece_chosen(self, name, piece):
+        pass
+
+    # The named player placed the held piece on square row, col (0-3)
+    def square_chosen(self, name, row, col):
+        pass
+
+    # The named player is thinking about a move, what is "piece" or "square"
+    def waiting(self, name, what):
+        pass
+
+    # Any other news, e.g. the opponent quit
+    def message(self, text):
+        pass
+
+    def winner(self, name):
+        pass
+
+    def draw(self):
+        pass
+
+    # The game is over
+    def end(self):
+        pass
+
+# Shows nothing, for games nobody watches, e.g. batch runs of AI games
+class NullRenderer(Renderer):
+    pass
+
+# Prints the game as text to out, a file object, or the terminal by default
+class ConsoleRenderer(Renderer):
+    def __init__(self, out=None):
+        self._out = out
+
+    def _print(self, *args):
+        print(*args, file=self._out)
+
+    def welcome(self, p1_name, p2_name):
+        self._print("Welcome to the game between {} and {}!"
+                    .format(p1_name, p2_name))
+        self._print()
+        self._print("Instructions:")
+        self._print(GameIO.instructions.format(GameIO.figures[9]))
+        self._print()
+        self._print("On your marks, get set, go!")
+
+    def state(self, state):
+        board_figs = [GameIO.figures[col] for row in state.board
+                      for col in row]
         pieces_figs = [""]*16
         for p in state.pieces:
-            pieces_figs[p] = cls.figures[p]
-        print(cls._game_view_str.format(*board_figs, *pieces_figs))
-    
-    @classmethod
-    def print_winner(cls, name):
-        print("{} wins!".format(name))
+            pieces_figs[p] = GameIO.figures[p]
+        self._print(GameIO.game_view_str.format(*board_figs, *pieces_figs))
+
+    def piece_chosen(self, name, piece):
+        self._print("{} chose piece {}: {}"
+                    .format(name, piece+1, GameIO.figures[piece]))
+
+    def square_chosen(self, name, row, col):
+        self._print("{} chose square {}{}"
+                    .format(name, row+1, GameIO.col_to_letter[col]))
+
+    def waiting(self, name, what):
+        self._print("Waiting for opponent {} to choose a {}..."
+                    .format(name, what))
+
+    def message(self, text):
+        self._print(text)
+
+    def winner(self, name):
+        self._print("{} wins!".format(name))
+
+    def draw(self):
+        self._print("Draw!")
+
+    def end(self):
+        self._print()
+
+# Keeps the text the console would show in memory, e.g. to log the game
+# once it's over
+class BufferedRenderer(ConsoleRenderer):
+    def __init__(self):
+        super().__init__(io.StringIO())
+
+    # Returns everything rendered since creation or the last clear()
+    @property
+    def text(self):
+        return self._out.getvalue()
 
-    @classmethod
-    def print_draw(cls):
-        print("Draw!")
+    def clear(self):
+        self._out.seek(0)
+        self._out.truncate()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+import argparse
+import struct
+from state import State
+
+# Game records.
+#
+# A compact binary log of played games, so that every game can be archived
+# and replayed. Files are written by appending, one record per game, and
+# read() streams records one at a time, so a file with millions of games is
+# never loaded at once.
+#
+# File format: a 4 byte magic, then records back to back. A record is a
+# fixed header
+#   name lengths      2 bytes, one per player, of the UTF-8 names
+#   difficulties      2 bytes, one per player, 0 for human players
+#   seed              8 bytes, big-endian, all ones if none, so seeds
+#                     range from 0 to MAX_SEED
+#   result            1 byte, one of WIN_P1, WIN_P2, DRAW, UNFINISHED
+#   number of moves   1 byte
+# followed by the player names, cut to 255 bytes at a character boundary,
+# and the moves, one byte per move. Moves alternate between picks and
+# placements, starting with a pick by player 1: a pick is the piece (0-15),
+# a placement the square (row*4 + col). The second player places the first
+# piece and picks the second, and so on.
+
+WIN_P1, WIN_P2, DRAW, UNFINISHED = 0, 1, 2, 3
+
+_MAGIC = b"QGR1"
+_HEADER = struct.Struct(">BBBBQBB")
+_NO_SEED = 2**64 - 1
+_MAX_NAME = 255
+
+MAX_SEED = _NO_SEED - 1
+
+# Raises ValueError if seed can't be stored in a record
+def check_seed(seed):
+    if seed is not None and not (isinstance(seed, int) and
+                                 0 <= seed <= MAX_SEED):
+        raise ValueError("Seed must be an integer from 0 to {}: {!r}"
+                         .format(MAX_SEED, seed))
+
+class GameRecord(object):
+    # players are the names of the players, in the order they play.
+    # difficulties are the players' gameengine.Difficulty values, None for
+    # human players. seed is the seed of the game's random numbers, if any.
+    # moves is a sequence of move bytes, see above. The result is found by
+    # replaying the moves unless given.
+    def __init__(self, players, difficulties, seed, moves, result=None):
+        self._players = tuple(players)
+        self._difficulties = tuple(difficulties)
+        check_seed(seed)
+        self._seed = seed
+        self._moves = bytes(moves)
+        self._result = result if result is not None else \
+            _result_of(self._moves)
+
+    @property
+    def players(self):
+        return self._players
+
+    @property
+    def difficulties(self):
+        return self._difficulties
+
+    @property
+    def seed(self):
+        return self._seed
+
+    @property
+    def result(self):
+        return self._result
+
+    @property
+    def moves(self):
+        return self._moves
+
+    def __eq__(self, other):
+        return isinstance(other, GameRecord) and \
+            (self._players, self._difficulties, self._seed, self._moves,
+             self._result) == \
+            (other._players, other._difficulties, other._seed, other._moves,
+             other._result)
+
+    # Replays the game, yielding (state, move) before every move, where move
+    # is a piece for picks and a (row, col) pair for placements. The same
+    # state object is updated after each yield, so copy it to keep it.
+    def replay(self, state_cls=State):
+        state = state_cls()
+        for i, move in enumerate(self._moves):
+            if i % 2 == 0:
+                yield state, move
+                state.pick_piece(move)
+            else:
+                yield state, (move >> 2, move & 3)
+                state.place_piece(move >> 2, move & 3)
+
+# Returns the result of a game with the given moves
+def _result_of(moves):
+    state = State()
+    for i, move in enumerate(moves):
+        if i % 2 == 0:
+            state.pick_piece(move)
+            continue
+        state.place_piece(move >> 2, move & 3)
+        if state.has_winner():
+            # Placement i//2 is made by player 2 if even
+            return WIN_P2 if i//2 % 2 == 0 else WIN_P1
+    return DRAW if len(moves) == 32 else UNFINISHED
+
+# Encodes the name in at most _MAX_NAME bytes, without splitting a character
+def _encode_name(name):
+    return name.encode("utf-8")[:_MAX_NAME].decode("utf-8", "ignore") \
+        .encode("utf-8")
+
+def _pack(record):
+    names = [_encode_name(name) for name in record.players]
+    difficulties = [d or 0 for d in record.difficulties]
+    seed = _NO_SEED if record.seed is None else record.seed
+    return _HEADER.pack(len(names[0]), len(names[1]), *difficulties, seed,
+                        record.result, len(record.moves)) + \
+        names[0] + names[1] + record.moves
+
+# Appends records to a game record file, creating it if needed
+class GameRecordWriter(object):
+    def __init__(self, path):
+        self._file = open(path, "ab")
+        if self._file.tell() == 0:
+            self._file.write(_MAGIC)
+
+    def write(self, record):
+        self._file.write(_pack(record))
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# Appends one record to the file at path
+def append(path, record):
+    with GameRecordWriter(path) as writer:
+        writer.write(record)
+
+# Yields the records of the file at path, in order, reading one at a time
+def read(path):
+    with open(path, "rb") as f:
+        if f.read(len(_MAGIC)) != _MAGIC:
+            raise ValueError("Not a game record file: {}".format(path))
+        while True:
+            header = f.read(_HEADER.size)
+            if not header:
+                return
+            if len(header) < _HEADER.size:
+                raise ValueError("Truncated game record in {}".format(path))
+            len1, len2, d1, d2, seed, result, n_moves = \
+                _HEADER.unpack(header)
+            data = f.read(len1 + len2 + n_moves)
+            if len(data) < len1 + len2 + n_moves:
+                raise ValueError("Truncated game record in {}".format(path))
+            yield GameRecord((data[:len1].decode("utf-8"),
+                              data[len1:len1 + len2].decode("utf-8")),
+                             (d1 or None, d2 or None),
+                             None if seed == _NO_SEED else seed,
+                             data[len1 + len2:], result)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Summarizes a game record file.")
+    parser.add_argument("path", help="game record file")
+    args = parser.parse_args()
+    counts = [0]*4
+    for record in read(args.path):
+        counts[record.result] += 1
+    print("Games: {}".format(sum(counts)))
+    print("Player 1 wins: {}".format(counts[WIN_P1]))
+    print("Player 2 wins: {}".format(counts[WIN_P2]))
+    print("Draws: {}".format(counts[DRAW]))
+    print("Unfinished: {}".format(counts[UNFINISHED]))
+
+if __name__ == "__main__":
+    main()
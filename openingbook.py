@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import struct
+from state import State
+from symmetry import canonical_form, to_canonical_move, from_canonical_move
+
+# Opening book.
+#
+# Holds the best move of every position in the first plies of the game, up
+# to a number of placed pieces, as found by a deeper search than the AI can
+# afford during play. Positions are keyed on their canonical form (see
+# symmetry.py), so the many symmetric openings share one entry, and moves
+# are stored in the canonical position's orientation.
+#
+# File format: a header (magic, max number of placed pieces, number of
+# records) followed by records sorted by key:
+#   key       11 bytes, big-endian canonical key
+#   square     1 byte, square (row*4 + col), or 16 if none
+#   piece      1 byte, piece, or 16 if none
+#
+# The book is small, so lookup() reads the whole file into a dict, but only
+# on first use, so that programs importing the AI don't pay for it unless
+# it plays.
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "openingbook.bin")
+
+_MAGIC = b"QOB1"
+_HEADER = struct.Struct(">4sBI")
+_KEY_SIZE = 11
+_RECORD_SIZE = _KEY_SIZE + 2
+_NONE = 16
+
+# Books by path, loaded on first lookup, as (max number of placed pieces,
+# dict from keys to moves). None if there is no book there.
+_books = {}
+
+def _load(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, placed, size = _HEADER.unpack_from(data)
+    if magic != _MAGIC:
+        raise ValueError("Not an opening book file: {}".format(path))
+    book = {}
+    for i in range(size):
+        offset = _HEADER.size + i*_RECORD_SIZE
+        key = int.from_bytes(data[offset:offset + _KEY_SIZE], "big")
+        square, piece = data[offset + _KEY_SIZE:offset + _RECORD_SIZE]
+        book[key] = (None if square == _NONE else (square >> 2, square & 3),
+                     None if piece == _NONE else piece)
+    return placed, book
+
+# Returns the book move of the state as a (square, piece) pair, in the same
+# format as the AI's moves, or None if the state is not in the book.
+def lookup(state, path=DEFAULT_PATH):
+    if path not in _books:
+        _books[path] = _load(path)
+    if _books[path] is None:
+        return None
+    placed, book = _books[path]
+    if 16 - len(state.free_squares()) > placed:
+        return None
+    key, sym, pmap = canonical_form(state)
+    move = book.get(key)
+    if move is None:
+        return None
+    return from_canonical_move(move, sym, pmap)
+
+# Builds an opening book at path, with every position with at most placed
+# pieces on the board, both before picking a piece and before placing one,
+# searched to the given depth.
+def build(path, placed=2, depth=3):
+    import gameengine
+    ai = gameengine.AI(gameengine.Difficulty.HIGH)
+    book = {}
+    frontier = [State()]
+    while frontier:
+        state = frontier.pop()
+        key, sym, pmap = canonical_form(state)
+        if key in book:
+            continue
+        move = ai.evaluate_move(state, depth=depth)[1]
+        book[key] = to_canonical_move(move, sym, pmap)
+        if state.is_holding():
+            if 16 - len(state.free_squares()) < placed:
+                for row, col in state.free_squares():
+                    child = state.copy()
+                    child.place_piece(row, col)
+                    frontier.append(child)
+        else:
+            for piece in state.pieces:
+                child = state.copy()
+                child.pick_piece(piece)
+                frontier.append(child)
+    with open(path, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, placed, len(book)))
+        for key in sorted(book):
+            square, piece = book[key]
+            f.write(key.to_bytes(_KEY_SIZE, "big"))
+            f.write(bytes([_NONE if square is None
+                           else 4*square[0] + square[1],
+                           _NONE if piece is None else piece]))
+    _books.pop(path, None)
+    return len(book)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Builds the opening book of the AI.")
+    parser.add_argument("path", nargs="?", default=DEFAULT_PATH,
+                        help="file to write the book to (default {})"
+                             .format(DEFAULT_PATH))
+    parser.add_argument("--placed", type=int, default=2,
+                        help="max number of pieces on the board of "
+                             "positions in the book (default 2)")
+    parser.add_argument("--depth", type=int, default=3,
+                        help="search depth of book moves (default 3)")
+    args = parser.parse_args()
+    size = build(args.path, args.placed, args.depth)
+    print("Wrote {} positions to {}".format(size, args.path))
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,15 @@
 #!/usr/bin/env python3
 
-from gameplatform import GameIO, GameCmd, GameStatusMsg
-from gameengine import AI
+import io
+import json
+import os
+import select
+import socket
+import sys
+import time
+from gameplatform import (GameIO, GameCmd, GameStatusMsg, ConsoleRenderer,
+                          OutOfTimeException)
+from gameengine import AI, MCTS, Engine, clock_budget
 
 class QuitException(Exception): pass
 class QuitHardException(Exception): pass
@@ -13,21 +21,89 @@ class AbsPlayer(object):
     # on game moves between computers on the network.
     _net_seg_size = 8
 
-    def __init__(self, name):
+    # Moves and news are shown through renderer, see gameplatform.Renderer.
+    # Defaults to printing to the terminal. A Game hands its own renderer to
+    # its players.
+    def __init__(self, name, renderer=None):
         self._name = name
+        self._renderer = renderer if renderer is not None else \
+            ConsoleRenderer()
 
     # Returns the name of the player.
     @property
     def name(self):
         return self._name
 
+    # Returns the gameengine.Difficulty of AI players, None for others
+    @property
+    def difficulty(self):
+        return None
+
+    @property
+    def renderer(self):
+        return self._renderer
+
+    @renderer.setter
+    def renderer(self, renderer):
+        self._renderer = renderer
+
     # Prompts the player to select a piece for the opponent to place.
     # Returns an integer in range 0-15.
-    def prompt_piece(self, state): raise NotImplementedError()
+    # time_limit is the number of seconds the player has for the move, or
+    # None if unlimited. Playing on a clock (see gameplatform.Clock), clock
+    # is (remaining, increment), the seconds the player has left for the
+    # rest of the game and the seconds added after each move.
+    # Players that can't budget their time ignore both.
+    def prompt_piece(self, state, time_limit=None, clock=None):
+        raise NotImplementedError()
     
     # Prompts the player for the coordinates of a square in which to place the
     # currently held piece. Returns two integers in range 0-3.
-    def prompt_square(self, state):  raise NotImplementedError()
+    # time_limit and clock are the same as for prompt_piece.
+    def prompt_square(self, state, time_limit=None, clock=None):
+        raise NotImplementedError()
+
+    # Called when the game is over, so that the player can stop anything it
+    # does while waiting for its turn.
+    def end_game(self):
+        pass
+
+    # Returns the seconds the player has for a move with the time_limit and
+    # clock of prompt_piece, or None if unlimited
+    @staticmethod
+    def _time_left(time_limit, clock):
+        if clock is None:
+            return time_limit
+        return clock[0] if time_limit is None else min(time_limit, clock[0])
+
+# Reads a line like input(), but raises OutOfTimeException if none comes
+# before deadline (a time.monotonic() time), if any. Waiting for the line
+# takes select(), so where it can't wait on standard input (e.g. on Windows
+# or if it isn't a terminal or pipe), the line is waited for without end.
+# The line is read unbuffered, so that select() sees all input not read.
+def _input(prompt, deadline):
+    if deadline is None:
+        return input(prompt)
+    print(prompt, end="", flush=True)
+    try:
+        fd = sys.stdin.fileno()
+        select.select([fd], [], [], 0)
+    except (OSError, ValueError, io.UnsupportedOperation):
+        return input()
+    line = bytearray()
+    while not line.endswith(b"\n"):
+        ready, _, _ = select.select([fd], [], [],
+                                    max(deadline - time.monotonic(), 0))
+        if not ready:
+            print()
+            raise OutOfTimeException()
+        byte = os.read(fd, 1)
+        if not byte:
+            if not line:
+                raise EOFError()
+            break
+        line += byte
+    return line.decode("utf-8", "replace").rstrip("\n")
 
 class HumanPlayer(AbsPlayer):
     _piece_msg = "{}, choose a piece for the opponent to place: "
@@ -36,9 +112,15 @@ class HumanPlayer(AbsPlayer):
     def __init__(self, name):
         super().__init__(name)
 
-    def prompt_piece(self, state):
+    # Input is given up on when the player's time runs out, see _input
+    def _deadline(self, time_limit, clock):
+        left = self._time_left(time_limit, clock)
+        return None if left is None else time.monotonic() + left
+
+    def prompt_piece(self, state, time_limit=None, clock=None):
         # Expects an integer in range [1,16], existing in state.pieces
-        p_str = input(self._piece_msg.format(self._name))
+        deadline = self._deadline(time_limit, clock)
+        p_str = _input(self._piece_msg.format(self._name), deadline)
         while True:
             p_str = p_str.strip()
             if p_str == GameCmd.QUIT:
@@ -46,20 +128,23 @@ class HumanPlayer(AbsPlayer):
             if p_str == GameCmd.HQUIT:
                 raise QuitHardException()
             if not p_str.isdigit():
-                p_str = input("Must be an integer, try again: ")
+                p_str = _input("Must be an integer, try again: ", deadline)
                 continue
             piece = int(p_str) - 1
             if not 0 <= piece <= 15:
-                p_str = input("Must be in interval [1,16], try again: ")
+                p_str = _input("Must be in interval [1,16], try again: ",
+                               deadline)
                 continue
             if piece not in state.pieces:
-                p_str = input("Piece is already played, try again: ")
+                p_str = _input("Piece is already played, try again: ",
+                               deadline)
                 continue
             return piece
 
-    def prompt_square(self, state):
+    def prompt_square(self, state, time_limit=None, clock=None):
         # Expects an input formed as a string of two coordinates, e.g. "2C"
-        sq_str = input(self._square_msg.format(self._name))
+        deadline = self._deadline(time_limit, clock)
+        sq_str = _input(self._square_msg.format(self._name), deadline)
         while True:
             sq_str = sq_str.strip()
             if sq_str == GameCmd.QUIT:
@@ -68,45 +153,102 @@ class HumanPlayer(AbsPlayer):
                 raise QuitHardException()
             sq_str = sq_str.upper()
             if len(sq_str) != 2:
-                sq_str = input("Provide two coordinates, try again: ")
+                sq_str = _input("Provide two coordinates, try again: ",
+                                deadline)
                 continue
             if not sq_str[0].isdigit() or not 1 <= int(sq_str[0]) <= 4:
-                sq_str = input("Invalid row coordinate, try again: ")
+                sq_str = _input("Invalid row coordinate, try again: ",
+                                deadline)
                 continue
             if not sq_str[1] in "ABCD":
-                sq_str = input("Invalid column coordinate, try again: ")
+                sq_str = _input("Invalid column coordinate, try again: ",
+                                deadline)
                 continue
             row, col = int(sq_str[0])-1, GameIO.letter_to_col[sq_str[1]]
             if state.square(row, col) is not None:
-                sq_str = input("Square is occupied, try again: ")
+                sq_str = _input("Square is occupied, try again: ", deadline)
                 continue
             return row, col
 
 class AIPlayer(AbsPlayer):
-    def __init__(self, name, difficulty):
-        super().__init__("AI " + name)
-        self._ai = AI(difficulty)
+    _engines = {Engine.MINIMAX: AI, Engine.MCTS: MCTS}
+
+    # time_limit is the default number of seconds per move, see gameengine.AI
+    # engine is the search algorithm, one of gameengine.Engine
+    # With ponder=True, the AI searches the opponent's replies while the
+    # opponent thinks, see gameengine.AI.ponder. Minimax engine only.
+    # With a stats_log path, the statistics of every move (see stats) are
+    # appended to that file as a line of JSON.
+    def __init__(self, name, difficulty, time_limit=None,
+                 engine=Engine.MINIMAX, ponder=False, stats_log=None,
+                 renderer=None):
+        super().__init__("AI " + name, renderer)
+        if ponder and engine != Engine.MINIMAX:
+            raise ValueError("Only the minimax engine can ponder")
+        self._ai = self._engines[engine](difficulty, time_limit=time_limit)
+        self._difficulty = difficulty
+        self._ponder = ponder
+        self._stats_log = stats_log
+
+    @property
+    def difficulty(self):
+        return self._difficulty
+
+    # Returns the search statistics of the player's last move, as a
+    # gameengine.SearchStats, or None before the first move.
+    @property
+    def stats(self):
+        return self._ai.last_stats
+
+    # On a clock, the move gets its share of the remaining time, see
+    # gameengine.clock_budget
+    def _budget(self, state, time_limit, clock):
+        if clock is None:
+            return time_limit
+        budget = clock_budget(state, *clock)
+        return budget if time_limit is None else min(time_limit, budget)
+
+    def _log_stats(self, kind, move):
+        if self._stats_log is None:
+            return
+        record = dict(self.stats.as_dict(), player=self._name, kind=kind,
+                      move=move)
+        with open(self._stats_log, "a") as f:
+            f.write(json.dumps(record) + "\n")
     
-    def prompt_piece(self, state):
-        p = self._ai.choose_piece(state)
-        print("{} chose piece {}: {}"
-              .format(self._name, p+1, GameIO.figures[p]))
+    def prompt_piece(self, state, time_limit=None, clock=None):
+        p = self._ai.choose_piece(state,
+                                  self._budget(state, time_limit, clock))
+        self._log_stats("piece", p)
+        self._renderer.piece_chosen(self._name, p)
+        # The opponent places the piece and picks one for us next
+        if self._ponder:
+            opp_state = state.copy()
+            opp_state.pick_piece(p)
+            self._ai.ponder(opp_state)
         return p
 
-    def prompt_square(self, state):
-        r, c = self._ai.choose_square(state)
-        print("{} chose square {}{}"
-              .format(self._name, r+1, GameIO.col_to_letter[c]))
+    def prompt_square(self, state, time_limit=None, clock=None):
+        if self._ponder:
+            self._ai.stop_pondering()
+        r, c = self._ai.choose_square(state,
+                                      self._budget(state, time_limit, clock))
+        self._log_stats("square", [r, c])
+        self._renderer.square_chosen(self._name, r, c)
         return r, c
 
+    def end_game(self):
+        if self._ponder:
+            self._ai.stop_pondering()
+
 class NetworkHumanPlayer(HumanPlayer):
     def __init__(self, name, opp_sock):
         super().__init__(name)
         self._opp_sock = opp_sock
 
-    def prompt_piece(self, state):
+    def prompt_piece(self, state, time_limit=None, clock=None):
         try:
-            piece = super().prompt_piece(state)
+            piece = super().prompt_piece(state, time_limit, clock)
             msg = "{0: <{cs}}".format(piece, cs=self._net_seg_size)
             self._opp_sock.send(msg.encode("utf-8"))
             return piece
@@ -119,9 +261,9 @@ class NetworkHumanPlayer(HumanPlayer):
             self._opp_sock.send(msg.encode("utf-8"))
             raise
 
-    def prompt_square(self, state):
+    def prompt_square(self, state, time_limit=None, clock=None):
         try:
-            row, col = super().prompt_square(state)
+            row, col = super().prompt_square(state, time_limit, clock)
             msg = "{0: <{cs}}".format(str(row) + str(col), cs=self._net_seg_size)
             self._opp_sock.send(msg.encode("utf-8"))
             return row, col
@@ -135,63 +277,81 @@ class NetworkHumanPlayer(HumanPlayer):
             raise
 
 class NetworkAIPlayer(AIPlayer):
-    def __init__(self, name, difficulty, opp_sock):
-        super().__init__(name, difficulty)
+    def __init__(self, name, difficulty, opp_sock, time_limit=None,
+                 engine=Engine.MINIMAX, ponder=False, stats_log=None,
+                 renderer=None):
+        super().__init__(name, difficulty, time_limit, engine, ponder,
+                         stats_log, renderer)
         self._opp_sock = opp_sock
 
-    def prompt_piece(self, state):
-        piece = super().prompt_piece(state)
+    def prompt_piece(self, state, time_limit=None, clock=None):
+        piece = super().prompt_piece(state, time_limit, clock)
         msg = "{0: <{cs}}".format(piece, cs=self._net_seg_size)
         self._opp_sock.send(msg.encode("utf-8"))
         return piece
 
-    def prompt_square(self, state):
-        row, col = super().prompt_square(state)
+    def prompt_square(self, state, time_limit=None, clock=None):
+        row, col = super().prompt_square(state, time_limit, clock)
         msg = "{0: <{cs}}".format(str(row) + str(col), cs=self._net_seg_size)
         self._opp_sock.send(msg.encode("utf-8"))
         return row, col
 
 class NetworkOpponent(AbsPlayer):
-    def __init__(self, name, sock):
-        super().__init__(name)
+    def __init__(self, name, sock, renderer=None):
+        super().__init__(name, renderer)
         self._sock = sock
 
-    def prompt_piece(self, _):
-        print("Waiting for opponent {} to choose a piece..."
-              .format(self._name))
+    # Receives the opponent's next message. On a clock, raises
+    # OutOfTimeException if it doesn't come in time.
+    def _receive(self, time_limit, clock):
+        timeout = self._sock.gettimeout()
+        self._sock.settimeout(self._time_left(time_limit, clock))
+        try:
+            msg = self._sock.recv(self._net_seg_size)
+        except socket.timeout:
+            raise OutOfTimeException()
+        finally:
+            self._sock.settimeout(timeout)
+        return msg.decode("utf-8").strip()
+
+    def prompt_piece(self, _, time_limit=None, clock=None):
+        self._renderer.waiting(self._name, "piece")
         # Should receive an integer in range [0,15] as a string
-        p_str = self._sock.recv(self._net_seg_size).decode("utf-8").strip()
+        p_str = self._receive(time_limit, clock)
         if p_str == GameCmd.QUIT:
-            print("Opponent forfeited and quit the game.")
+            self._renderer.message("Opponent forfeited and quit the game.")
             raise QuitException()
         elif p_str == GameCmd.HQUIT:
-            print("Opponent forfeited and closed their application.")
-            print("This application is now closing as well.")
+            self._renderer.message(
+                "Opponent forfeited and closed their application.")
+            self._renderer.message(
+                "This application is now closing as well.")
             raise QuitHardException()
         elif GameStatusMsg.ERROR in p_str:
-            print("An error occurred for the opponent, game will quit.")
+            self._renderer.message(
+                "An error occurred for the opponent, game will quit.")
             raise QuitException()
         piece = int(p_str)
-        print("{} chose piece {}: {}"
-              .format(self._name, piece+1, GameIO.figures[piece]))
+        self._renderer.piece_chosen(self._name, piece)
         return int(piece)
 
-    def prompt_square(self, _):
-        print("Waiting for opponent {} to choose a square..."
-              .format(self._name))
+    def prompt_square(self, _, time_limit=None, clock=None):
+        self._renderer.waiting(self._name, "square")
         # Should receive an integer in range [00,33] as a string
-        sq_str = self._sock.recv(self._net_seg_size).decode("utf-8").strip()
+        sq_str = self._receive(time_limit, clock)
         if sq_str == GameCmd.QUIT:
-            print("Opponent forfeited and quit the game.")
+            self._renderer.message("Opponent forfeited and quit the game.")
             raise QuitException()
         elif sq_str == GameCmd.HQUIT:
-            print("Opponent forfeited and closed their application.")
-            print("This application is now closing as well.")
+            self._renderer.message(
+                "Opponent forfeited and closed their application.")
+            self._renderer.message(
+                "This application is now closing as well.")
             raise QuitHardException()
         elif GameStatusMsg.ERROR in sq_str:
-            print("An error occurred for the opponent, game will quit.")
+            self._renderer.message(
+                "An error occurred for the opponent, game will quit.")
             raise QuitException()
         row, col = [int(x) for x in sq_str]
-        print("{} chose square {}{}"
-              .format(self._name, row+1, GameIO.col_to_letter[col]))
+        self._renderer.square_chosen(self._name, row, col)
         return row, col
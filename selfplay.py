@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import time
+import gameengine
+from gameengine import Difficulty, Engine
+from gameplatform import NullRenderer
+from player import AIPlayer
+from state import State
+
+# Headless self-play.
+#
+# Plays games between two AI players, in parallel on all cores, without
+# printing anything while the games run. The result of every game is
+# appended to a results file as a line of JSON as soon as the game ends:
+#   game        index of the game
+#   first       player who picked the first piece, "p1" or "p2"
+#   winner      "p1", "p2", or null for a draw
+#   moves       number of moves (picks and placements)
+#   move_times  seconds of every move, in order
+# When all games are over, win and draw rates and games per second are
+# printed. Players take turns to start, so neither gets the first move
+# more often.
+#
+# Example: python3 selfplay.py 100 --p1 high --p2 medium --p2-engine mcts
+
+DIFFICULTIES = {"low": Difficulty.LOW, "medium": Difficulty.MEDIUM,
+                "high": Difficulty.HIGH}
+ENGINES = {"minimax": Engine.MINIMAX, "mcts": Engine.MCTS}
+
+# Plays one game, given as (index, p1, p2, time_limit, seed), where p1 and
+# p2 are (difficulty, engine) pairs. Returns the game's result record.
+def play_game(game):
+    index, p1, p2, time_limit, seed = game
+    gameengine.seed(seed)
+    names = ["p1", "p2"]
+    players = [AIPlayer(names[0], p1[0], time_limit, engine=p1[1],
+                        renderer=NullRenderer()),
+               AIPlayer(names[1], p2[0], time_limit, engine=p2[1],
+                        renderer=NullRenderer())]
+    if index % 2:
+        names.reverse()
+        players.reverse()
+    state = State()
+    move_times = []
+    cp = 0
+    while True:
+        start = time.perf_counter()
+        piece = players[cp].prompt_piece(state, time_limit)
+        move_times.append(time.perf_counter() - start)
+        state.pick_piece(piece)
+        cp ^= 1
+        start = time.perf_counter()
+        row, col = players[cp].prompt_square(state, time_limit)
+        move_times.append(time.perf_counter() - start)
+        state.place_piece(row, col)
+        if state.has_winner() or state.is_draw():
+            break
+    for p in players:
+        p.end_game()
+    return {"game": index,
+            "first": names[0],
+            "winner": names[cp] if state.has_winner() else None,
+            "moves": len(move_times),
+            "move_times": move_times}
+
+# Plays the games, writing results to results_path as they come in, and
+# returns the aggregate statistics.
+def run(games, p1, p2, results_path, time_limit=None, workers=None,
+        seed=None):
+    if seed is None:
+        seed = random.randrange(2**32)
+    jobs = [(i, p1, p2, time_limit, seed + i) for i in range(games)]
+    wins = {"p1": 0, "p2": 0, None: 0}
+    moves = 0
+    start = time.monotonic()
+    with open(results_path, "a") as results, \
+            multiprocessing.Pool(workers) as pool:
+        for result in pool.imap_unordered(play_game, jobs):
+            results.write(json.dumps(result) + "\n")
+            results.flush()
+            wins[result["winner"]] += 1
+            moves += result["moves"]
+    elapsed = time.monotonic() - start
+    return {"games": games,
+            "p1_win_rate": wins["p1"] / games,
+            "p2_win_rate": wins["p2"] / games,
+            "draw_rate": wins[None] / games,
+            "average_moves": moves / games,
+            "games_per_second": games / elapsed}
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Plays AI against AI without output, on all cores.")
+    parser.add_argument("games", type=int, help="number of games")
+    for p in ("p1", "p2"):
+        parser.add_argument("--" + p, choices=DIFFICULTIES, default="high",
+                            help="difficulty of {} (default high)".format(p))
+        parser.add_argument("--{}-engine".format(p), choices=ENGINES,
+                            default="minimax",
+                            help="engine of {} (default minimax)".format(p))
+    parser.add_argument("--time-limit", type=float, default=None,
+                        help="seconds per move (default none)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="number of processes (default all cores)")
+    parser.add_argument("--results", default="selfplay.jsonl",
+                        help="file to append game results to "
+                             "(default selfplay.jsonl)")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="seed of the first game, the others follow")
+    args = parser.parse_args()
+    p1 = (DIFFICULTIES[args.p1], ENGINES[args.p1_engine])
+    p2 = (DIFFICULTIES[args.p2], ENGINES[args.p2_engine])
+    stats = run(args.games, p1, p2, args.results, args.time_limit,
+                args.workers, args.seed)
+    print("Games: {}".format(stats["games"]))
+    print("p1 ({}, {}) wins: {:.1%}".format(args.p1, args.p1_engine,
+                                            stats["p1_win_rate"]))
+    print("p2 ({}, {}) wins: {:.1%}".format(args.p2, args.p2_engine,
+                                            stats["p2_win_rate"]))
+    print("Draws: {:.1%}".format(stats["draw_rate"]))
+    print("Average moves per game: {:.1f}".format(stats["average_moves"]))
+    print("Games per second: {:.2f}".format(stats["games_per_second"]))
+
+if __name__ == "__main__":
+    main()
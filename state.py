@@ -1,19 +1,111 @@
 #!/usr/bin/env python3
 
+import random
+import struct
 from functools import reduce
+from operator import or_
+
+# Square indices (row*4 + col) of all rows, columns and diagonals of the
+# board, in the same order as returned by get_vectors().
+_LINES = (tuple(tuple(4*r + c for c in range(4)) for r in range(4)) +
+          tuple(tuple(4*r + c for r in range(4)) for c in range(4)) +
+          (tuple(5*i for i in range(4)), tuple(3*i + 3 for i in range(4))))
+# Indices (into _LINES) of the 2 or 3 lines passing through each square.
+_SQUARE_LINES = tuple(tuple(i for i, line in enumerate(_LINES) if sq in line)
+                      for sq in range(16))
+
+# Line summaries, see AbsState.line_summaries(). Placing a piece on a line
+# adds 1 to the count and clears the attribute bits the piece doesn't
+# share, which is an addition of _COUNT_ONE and an AND with
+# _PLACE_MASKS[piece]. A line is won if it has 4 pieces (bit 10 set, as
+# the count never exceeds 4) and any common attribute.
+_EMPTY_LINE = 0b1111 << 4 | 0b1111
+_COUNT_ONE = 1 << 8
+_PLACE_MASKS = tuple(0xF00 | p << 4 | (0b1111 - p) for p in range(16))
+
+def _is_won_line(summary):
+    return summary >= 4 << 8 and summary & 0xFF
+
+# Pieces that would complete a winning line, by line summary, as 16-bit masks
+# with bit p set for piece p. Only lines with 3 pieces can be completed, by
+# the pieces sharing an attribute with all three.
+_COMPLETERS = tuple(
+    sum(1 << p for p in range(16)
+        if (s >> 4 & p) | (s & (0b1111 - p)) & 0b1111)
+    if s >> 8 == 3 else 0
+    for s in range(5 << 8))
+
+# BitState keeps all 10 summaries in one integer, 16 bits per line, so
+# that they can all be read at once as little-endian 16-bit integers. The
+# increment and mask of a placement cover all lines through the square at
+# once, with the bits of the other lines left as they are.
+_ALL_LINES = (1 << 160) - 1
+_SQUARE_COUNT_ONES = tuple(sum(_COUNT_ONE << 16*i for i in _SQUARE_LINES[sq])
+                           for sq in range(16))
+_SQUARE_PLACE_MASKS = tuple(
+    tuple(reduce(lambda mask, i: mask & ~(0xFF << 16*i) |
+                 (_PLACE_MASKS[p] & 0xFF) << 16*i,
+                 _SQUARE_LINES[sq], _ALL_LINES)
+          for p in range(16))
+    for sq in range(16))
+_unpack_lines = struct.Struct("<10H").unpack
+# Pieces of each low and high byte of a 16-bit piece mask, so that a
+# BitState builds its pieces set with a single union
+_LOW_PIECES = tuple(frozenset(p for p in range(8) if m >> p & 1)
+                    for m in range(256))
+_HIGH_PIECES = tuple(frozenset(p + 8 for p in ps) for ps in _LOW_PIECES)
+# Attribute bits and lowest bit of every line of the packed summaries
+_ALL_ATTRS = sum(0xFF << 16*i for i in range(10))
+_ALL_LOWS = sum(1 << 16*i for i in range(10))
+
+# Same as any(map(_is_won_line, summaries)) for the packed summaries: the
+# attribute bits of each line are ORed into its lowest bit, which is then
+# shifted onto the bit of the line's count that is only set at 4 pieces.
+def _is_won_packed(lines):
+    common = lines & _ALL_ATTRS
+    common |= common >> 4
+    common |= common >> 2
+    common |= common >> 1
+    return bool((common & _ALL_LOWS) << 10 & lines)
+
+# Random 64-bit numbers for Zobrist hashing: one per (square, piece) pair,
+# one per remaining piece and one per held piece. A state's key is the XOR
+# of the numbers of everything in it, so a move updates the key with two
+# XORs. The generator is seeded, so keys are the same in every process.
+_zobrist_rng = random.Random(0x9A7E)
+_ZOBRIST_SQUARE = tuple(tuple(_zobrist_rng.getrandbits(64) for _ in range(16))
+                        for _ in range(16))
+_ZOBRIST_PIECE = tuple(_zobrist_rng.getrandbits(64) for _ in range(16))
+_ZOBRIST_HELD = tuple(_zobrist_rng.getrandbits(64) for _ in range(16))
+del _zobrist_rng
+
+def _zobrist_key(board, pieces, held_piece):
+    key = 0
+    for row in range(4):
+        for col in range(4):
+            if board[row][col] is not None:
+                key ^= _ZOBRIST_SQUARE[4*row + col][board[row][col]]
+    for p in pieces:
+        key ^= _ZOBRIST_PIECE[p]
+    if held_piece is not None:
+        key ^= _ZOBRIST_HELD[held_piece]
+    return key
 
 class AbsState(object):
-    # Returns the current board state as a matrix (array of arrays), where
-    # elements are integers in range 0-15, or None for empty squares.
+    # No instance dictionary, so subclasses can use __slots__
+    __slots__ = ()
+    # Returns the current board state as a read-only matrix (tuple of tuples),
+    # where elements are integers in range 0-15, or None for empty squares.
     @property
     def board(self):                 raise NotImplementedError()
-    # Updates the board state. Accepts a board of the same format as above.
+    # Updates the board state. Accepts a matrix of the same format as above,
+    # or as a list of lists.
     @board.setter
     def board(self, b):              raise NotImplementedError()
-    # Returns the remaining pieces as a set of integers in range 0-15.
+    # Returns the remaining pieces as a frozenset of integers in range 0-15.
     @property
     def pieces(self):                raise NotImplementedError()
-    # Updates the remaining pieces. Accepts a set of the same format as above.
+    # Updates the remaining pieces. Accepts any iterable of such integers.
     @pieces.setter
     def pieces(self, ps):            raise NotImplementedError()
     # Returns the current held piece as an int in range 0-15,
@@ -42,41 +134,112 @@ class AbsState(object):
     def copy(self):                  raise NotImplementedError()
     # Returns an array of all rows, columns and diagonals of the board.
     def get_vectors(self):           raise NotImplementedError()
+    # Same as pick_piece, but the move can later be taken back with undo().
+    def push_pick(self, piece):      raise NotImplementedError()
+    # Same as place_piece, but the move can later be taken back with undo().
+    def push_place(self, row, col):  raise NotImplementedError()
+    # Takes back the most recent push_pick or push_place.
+    # Lets a search walk the game tree in place, without copying the state.
+    def undo(self):                  raise NotImplementedError()
+    # Returns a 64-bit Zobrist hash of the board, the remaining pieces and
+    # the held piece. Equal states always have equal keys.
+    @property
+    def key(self):                   raise NotImplementedError()
+    # Returns a summary of each line (same order as get_vectors()), as an
+    # integer count << 8 | AND << 4 | ANDNOT, where count is the number of
+    # pieces in the line, AND the AND of them (common 1 attributes) and
+    # ANDNOT the AND of their complements (common 0 attributes). Empty
+    # lines have all attribute bits set. Kept up to date by every placement.
+    def line_summaries(self):        raise NotImplementedError()
+    # Returns, for each line, the pieces that would win the game if placed on
+    # it, as a 16-bit mask with bit p set for piece p.
+    def line_completers(self):
+        return tuple(map(_COMPLETERS.__getitem__, self.line_summaries()))
+    # Returns the pieces that would win the game if placed somewhere, as a
+    # mask like above. Handing any of them to the opponent loses the game.
+    def deadly_pieces(self):
+        return reduce(or_, map(_COMPLETERS.__getitem__,
+                               self.line_summaries()), 0)
 
 # Pieces are represented with integers 0-15.
 # Board is represented by a matrix of integers 0-15, or None if empty square.
 class State(AbsState):
+    __slots__ = ('_board', '_pieces', '_held_piece', '_history',
+                 '_lines', '_won',
+                 '_board_view', '_pieces_view', '_key')
+
     def __init__(self, 
                  board=[[None for _ in range(4)] for _ in range(4)], 
                  pieces=set(range(16)), 
                  held_piece=None):
-        self.board = board
-        self.pieces = pieces
+        self._board = [list(row) for row in board]
+        self._pieces = set(pieces)
         self._held_piece = held_piece
+        self._board_view = self._pieces_view = None
+        self._init_lines()
+        self._key = _zobrist_key(self._board, self._pieces, held_piece)
+        # Undo records of pushed moves, see push_pick/push_place
+        self._history = []
     
-    # When using the public property to access the board, always return a 
-    # copy, not the actual reference to the board object.
+    # Besides the board itself, the summary of every line is kept (see
+    # line_summaries()). A placement only touches the lines through its
+    # square, and only those lines can become a winning line, so _won is
+    # kept up to date without ever scanning the whole board.
+    def _init_lines(self):
+        self._lines = [_EMPTY_LINE]*10
+        for row in range(4):
+            for col in range(4):
+                if self._board[row][col] is not None:
+                    self._add_to_lines(4*row + col, self._board[row][col])
+        self._won = any(map(self._win_vec, self.get_vectors()))
+
+    def _add_to_lines(self, sq, piece):
+        won = False
+        lines, mask = self._lines, _PLACE_MASKS[piece]
+        for i in _SQUARE_LINES[sq]:
+            lines[i] = (lines[i] + _COUNT_ONE) & mask
+            if _is_won_line(lines[i]):
+                won = True
+        return won
+
+    # When using the public property to access the board, never return the
+    # actual reference to the board object. An immutable view is built on
+    # first access and cached until the board changes, so repeated reads
+    # don't allocate anything.
     @property
     def board(self):
-        return [row[:] for row in self._board]
+        if self._board_view is None:
+            self._board_view = tuple(map(tuple, self._board))
+        return self._board_view
     # When using the public property to set the board, always take a copy of 
     # the provided board first, to avoid leaking a reference to our state.
     @board.setter
     def board(self, b):
-        self._board = [row[:] for row in b]
+        self._board = [list(row) for row in b]
+        self._board_view = None
+        self._init_lines()
+        self._key = _zobrist_key(self._board, self._pieces, self._held_piece)
     
-    # Return a copy of the pieces set, for the same reason as for the board.
+    # Return a cached frozenset view, for the same reason as for the board.
     @property
     def pieces(self):
-        return self._pieces.copy()
+        if self._pieces_view is None:
+            self._pieces_view = frozenset(self._pieces)
+        return self._pieces_view
     # Take a copy of the provided set, for the same reason as for the board.
     @pieces.setter
     def pieces(self, ps):
-        self._pieces = ps.copy()
+        self._pieces = set(ps)
+        self._pieces_view = None
+        self._key = _zobrist_key(self._board, self._pieces, self._held_piece)
 
     @property
     def held_piece(self):
         return self._held_piece
+
+    @property
+    def key(self):
+        return self._key
     
     def is_holding(self):
         return self._held_piece is not None
@@ -87,7 +250,9 @@ class State(AbsState):
         if piece not in self._pieces:
             raise ValueError("Piece has already been played")
         self._pieces.remove(piece)
+        self._pieces_view = None
         self._held_piece = piece
+        self._key ^= _ZOBRIST_PIECE[piece] ^ _ZOBRIST_HELD[piece]
     
     def place_piece(self, row, col):
         if not self.is_holding():
@@ -95,6 +260,11 @@ class State(AbsState):
         if self.square(row, col) is not None:
             raise ValueError("Square is occupied")
         self._board[row][col] = self._held_piece
+        self._board_view = None
+        if self._add_to_lines(4*row + col, self._held_piece):
+            self._won = True
+        self._key ^= (_ZOBRIST_HELD[self._held_piece] ^
+                      _ZOBRIST_SQUARE[4*row + col][self._held_piece])
         self._held_piece = None
     
     def square(self, row, col):
@@ -109,12 +279,7 @@ class State(AbsState):
         return squares
     
     def has_winner(self):
-        board_t = self._transpose(self._board)
-        for i in range(4):
-            if self._win_vec(self._board[i]) or self._win_vec(board_t[i]):
-               return True
-        d1, d2 = self._get_diags(self._board)
-        return (self._win_vec(d1) or self._win_vec(d2))
+        return self._won
     
     def is_draw(self):
         return (not self._pieces and
@@ -122,15 +287,64 @@ class State(AbsState):
                 not self.has_winner())
     
     def copy(self):
-        return State([row[:] for row in self._board], 
-                     self._pieces.copy(),
-                     self._held_piece)
+        # Copy the line summaries as well, instead of recomputing them
+        state = State.__new__(State)
+        state._board = [row[:] for row in self._board]
+        state._pieces = self._pieces.copy()
+        state._held_piece = self._held_piece
+        state._lines = self._lines[:]
+        state._won = self._won
+        state._key = self._key
+        state._history = []
+        # The views are immutable, so they can be shared
+        state._board_view = self._board_view
+        state._pieces_view = self._pieces_view
+        return state
+
+    def line_summaries(self):
+        return tuple(self._lines)
+
+    def deadly_pieces(self):
+        return reduce(or_, map(_COMPLETERS.__getitem__, self._lines), 0)
 
     def get_vectors(self):
         return ([row[:] for row in self._board] +
                 self._transpose(self._board) +
                 list(self._get_diags(self._board)))
     
+    # A pick is recorded as just the piece. A placement is recorded with the
+    # square and the previous summaries of the lines through it, since the
+    # ANDs in them can't be reverted by themselves.
+    def push_pick(self, piece):
+        self.pick_piece(piece)
+        self._history.append(piece)
+
+    def push_place(self, row, col):
+        sq = 4*row + col
+        lines = _SQUARE_LINES[sq]
+        record = (sq, [self._lines[i] for i in lines], self._won)
+        self.place_piece(row, col)
+        self._history.append(record)
+
+    def undo(self):
+        record = self._history.pop()
+        if isinstance(record, int):
+            self._pieces.add(record)
+            self._pieces_view = None
+            self._held_piece = None
+            self._key ^= _ZOBRIST_PIECE[record] ^ _ZOBRIST_HELD[record]
+            return
+        sq, summaries, won = record
+        row, col = sq >> 2, sq & 3
+        self._held_piece = self._board[row][col]
+        self._board[row][col] = None
+        self._board_view = None
+        self._key ^= (_ZOBRIST_HELD[self._held_piece] ^
+                      _ZOBRIST_SQUARE[sq][self._held_piece])
+        for i, summary in zip(_SQUARE_LINES[sq], summaries):
+            self._lines[i] = summary
+        self._won = won
+
     def _transpose(self, mat):
         return list(map(list, zip(*mat)))
     
@@ -142,3 +356,157 @@ class State(AbsState):
         return (not None in vec and 
                 bool(reduce(lambda x, y: x & y, vec, 0b1111) | 
                      reduce(lambda x, y: x & (0b1111 - y), vec, 0b1111)))
+
+# Pieces and board packed into integers. Square (row, col) has index
+# row*4 + col, and its piece is stored in bits 4*index to 4*index + 3 of
+# _cells, with bit index of _occupied set if the square is non-empty.
+# The remaining pieces are stored as a 16-bit mask, bit p set if piece p is
+# still available, and the line summaries as bits 16*i to 16*i + 15 of
+# _lines for line i. Every operation is then a handful of integer
+# operations, and copying the state is just copying a few integers.
+# Whether the board is won is kept in _won, as has_winner() is called far
+# more often than pieces are placed.
+class BitState(AbsState):
+    __slots__ = ('_cells', '_occupied', '_pieces', '_held_piece', '_key',
+                 '_lines', '_won', '_history')
+
+    def __init__(self,
+                 board=[[None for _ in range(4)] for _ in range(4)],
+                 pieces=set(range(16)),
+                 held_piece=None):
+        self._cells = self._occupied = self._pieces = 0
+        self._held_piece = held_piece
+        self.board = board
+        self.pieces = pieces
+        self._history = []
+
+    @classmethod
+    def _packed(cls, cells, occupied, pieces, held_piece, key, lines, won):
+        state = cls.__new__(cls)
+        state._cells = cells
+        state._occupied = occupied
+        state._pieces = pieces
+        state._held_piece = held_piece
+        state._key = key
+        state._lines = lines
+        state._won = won
+        state._history = []
+        return state
+
+    # The packed representation is immutable, so the public properties build
+    # new objects in the same format as State, and cannot leak a reference.
+    @property
+    def board(self):
+        return tuple(tuple(self.square(row, col) for col in range(4))
+                     for row in range(4))
+    @board.setter
+    def board(self, b):
+        self._cells = 0
+        self._occupied = 0
+        self._lines = sum(_EMPTY_LINE << 16*i for i in range(10))
+        self._won = False
+        for row in range(4):
+            for col in range(4):
+                if b[row][col] is not None:
+                    self._set_square(4*row + col, b[row][col])
+        self._key = _zobrist_key(b, self.pieces, self._held_piece)
+
+    @property
+    def pieces(self):
+        return _LOW_PIECES[self._pieces & 0xFF] | \
+            _HIGH_PIECES[self._pieces >> 8]
+    # Take a copy first, as the input is read twice and may be an iterator
+    @pieces.setter
+    def pieces(self, ps):
+        ps = set(ps)
+        self._pieces = 0
+        for p in ps:
+            self._pieces |= 1 << p
+        self._key = _zobrist_key(self.board, ps, self._held_piece)
+
+    @property
+    def held_piece(self):
+        return self._held_piece
+
+    @property
+    def key(self):
+        return self._key
+
+    def is_holding(self):
+        return self._held_piece is not None
+
+    def pick_piece(self, piece):
+        if self.is_holding():
+            raise ValueError("Already holding a piece")
+        if not self._pieces >> piece & 1:
+            raise ValueError("Piece has already been played")
+        self._pieces ^= 1 << piece
+        self._held_piece = piece
+        self._key ^= _ZOBRIST_PIECE[piece] ^ _ZOBRIST_HELD[piece]
+
+    def place_piece(self, row, col):
+        if not self.is_holding():
+            raise ValueError("No piece to place")
+        sq = 4*row + col
+        if self._occupied >> sq & 1:
+            raise ValueError("Square is occupied")
+        self._set_square(sq, self._held_piece)
+        self._key ^= (_ZOBRIST_HELD[self._held_piece] ^
+                      _ZOBRIST_SQUARE[sq][self._held_piece])
+        self._held_piece = None
+
+    def _set_square(self, sq, piece):
+        self._cells |= piece << 4*sq
+        self._occupied |= 1 << sq
+        self._lines = ((self._lines + _SQUARE_COUNT_ONES[sq]) &
+                       _SQUARE_PLACE_MASKS[sq][piece])
+        self._won = _is_won_packed(self._lines)
+
+    def square(self, row, col):
+        sq = 4*row + col
+        if not self._occupied >> sq & 1:
+            return None
+        return self._cells >> 4*sq & 0b1111
+
+    def free_squares(self):
+        free = ~self._occupied & 0xFFFF
+        return [(sq >> 2, sq & 3) for sq in range(16) if free >> sq & 1]
+
+    def has_winner(self):
+        return self._won
+
+    def is_draw(self):
+        return (not self._pieces and
+                self._held_piece is None and
+                not self.has_winner())
+
+    def copy(self):
+        return BitState._packed(self._cells, self._occupied, self._pieces,
+                                self._held_piece, self._key, self._lines,
+                                self._won)
+
+    def line_summaries(self):
+        return _unpack_lines(self._lines.to_bytes(20, "little"))
+
+    def get_vectors(self):
+        return [[self._cells >> 4*sq & 0b1111
+                 if self._occupied >> sq & 1 else None
+                 for sq in line] for line in _LINES]
+
+    # The whole state is seven values, so an undo record is just all of them.
+    def push_pick(self, piece):
+        record = (self._cells, self._occupied, self._pieces,
+                  self._held_piece, self._key, self._lines, self._won)
+        self.pick_piece(piece)
+        self._history.append(record)
+
+    def push_place(self, row, col):
+        record = (self._cells, self._occupied, self._pieces,
+                  self._held_piece, self._key, self._lines, self._won)
+        self.place_piece(row, col)
+        self._history.append(record)
+
+    def undo(self):
+        (self._cells, self._occupied, self._pieces,
+         self._held_piece, self._key, self._lines,
+         self._won) = self._history.pop()
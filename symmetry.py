@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+
+from itertools import permutations
+
+# Symmetries of Quarto positions.
+#
+# A position can be transformed without changing the game in two ways:
+# - The squares can be permuted, as long as rows, columns and diagonals are
+#   mapped onto rows, columns and diagonals. Besides the 8 rotations and
+#   reflections, this includes swapping the two middle rows and columns, and
+#   turning the board "inside out" (swapping rows 0/1 and 2/3, and the same
+#   for columns), which together give 32 board symmetries.
+# - The pieces can be relabeled, by permuting the 4 attributes (24 ways) and
+#   complementing any subset of them (16 ways), which gives 384 piece maps.
+#
+# canonical_form() finds the smallest encoding of a position over all these
+# transformations, so that every position in an equivalence class gets the
+# same key. The remaining pieces are determined by the board and the held
+# piece, so only those two are part of the key.
+
+def _square_perm(f):
+    return tuple(f(sq >> 2, sq & 3) for sq in range(16))
+
+def _compose(a, b):
+    return tuple(a[b[i]] for i in range(16))
+
+def _closure(generators):
+    group = {tuple(range(16))}
+    frontier = list(group)
+    while frontier:
+        new = []
+        for g in frontier:
+            for h in generators:
+                gh = _compose(g, h)
+                if gh not in group:
+                    group.add(gh)
+                    new.append(gh)
+        frontier = new
+    return sorted(group)
+
+_MID = (0, 2, 1, 3)
+_OUT = (1, 0, 3, 2)
+
+# Each symmetry is a tuple sym, where sym[i] is the square (row*4 + col)
+# that is moved to square i.
+SQUARE_SYMMETRIES = tuple(_closure([
+    _square_perm(lambda r, c: 4*c + (3 - r)),          # rotation
+    _square_perm(lambda r, c: 4*r + (3 - c)),          # reflection
+    _square_perm(lambda r, c: 4*_MID[r] + _MID[c]),    # middle swap
+    _square_perm(lambda r, c: 4*_OUT[r] + _OUT[c]),    # inside out
+]))
+
+def _attr_perm(perm, x):
+    return sum((x >> i & 1) << perm[i] for i in range(4))
+
+# Each piece map is a tuple pmap, where pmap[p] is the piece p is mapped to.
+PIECE_MAPS = tuple(tuple(_attr_perm(perm, p ^ mask) for p in range(16))
+                   for mask in range(16)
+                   for perm in permutations(range(4)))
+
+# canonical_form() narrows down sets of piece maps one piece at a time,
+# keeping the maps that send the piece to the smallest piece possible. The
+# sets are numbered as they are first reached, _MAP_SETS[i] holding the maps
+# of set i, and the step from set i with piece p is cached in _STEPS[i][p]
+# as (smallest piece, next set). Set 0 holds all the maps.
+_MAP_SETS = [PIECE_MAPS]
+_MAP_SET_IDS = {tuple(range(len(PIECE_MAPS))): 0}
+_STEPS = [[None]*16]
+_MAP_INDEX = {m: i for i, m in enumerate(PIECE_MAPS)}
+
+def _step(i, p):
+    maps = _MAP_SETS[i]
+    low = min(m[p] for m in maps)
+    maps = tuple(m for m in maps if m[p] == low)
+    ids = tuple(_MAP_INDEX[m] for m in maps)
+    j = _MAP_SET_IDS.get(ids)
+    if j is None:
+        j = _MAP_SET_IDS[ids] = len(_MAP_SETS)
+        _MAP_SETS.append(maps)
+        _STEPS.append([None]*16)
+    _STEPS[i][p] = (low, j)
+    return low, j
+
+# Value used in keys for empty squares and for no held piece
+_EMPTY = 16
+# _EMPTY_TAILS[n] is n empty squares in a row of a key
+_EMPTY_TAILS = tuple(sum(_EMPTY << 5*i for i in range(n)) for n in range(17))
+# _SYMS_TO[i] maps each square that symmetries move to square i to those
+# symmetries
+_SYMS_TO = tuple({sq: tuple(sym for sym in SQUARE_SYMMETRIES if sym[i] == sq)
+                  for sq in sorted({sym[i] for sym in SQUARE_SYMMETRIES})}
+                 for i in range(16))
+
+# Returns (key, sym, pmap), where key is an integer that is equal for all
+# positions equivalent to state, and sym and pmap are a square symmetry and
+# piece map that transform state into the position the key was built from.
+# If several transformations give the key, any of them is returned.
+def canonical_form(state):
+    cells = [_EMPTY if p is None else p
+             for row in state.board for p in row]
+    held = state.held_piece
+    # The key is the lexicographically smallest sequence (held piece first,
+    # then the squares in order) over all transformations. All symmetries
+    # are tried side by side, each with the set of piece maps giving the
+    # smallest sequence so far, and dropped as soon as they fall behind.
+    if held is None:
+        key, start = _EMPTY, 0
+    else:
+        key, start = _STEPS[0][held] or _step(0, held)
+    placed = 16 - cells.count(_EMPTY)
+    if not placed:
+        return (key << 80 | _EMPTY_TAILS[16], SQUARE_SYMMETRIES[0],
+                _MAP_SETS[start][0])
+    # Up to the first square that gets a piece, all symmetries tie, and
+    # only the squares moved there need to be looked at.
+    sq = 0
+    while True:
+        best = _EMPTY
+        firsts = []
+        for from_sq, syms in _SYMS_TO[sq].items():
+            p = cells[from_sq]
+            if p != _EMPTY:
+                p, i = _STEPS[start][p] or _step(start, p)
+                if p < best:
+                    best = p
+                    firsts = [(syms, i)]
+                elif p == best:
+                    firsts.append((syms, i))
+        key = key << 5 | best
+        sq += 1
+        if firsts:
+            break
+    candidates = [(sym, i) for syms, i in firsts for sym in syms]
+    placed -= 1
+    # Once all pieces on the board are in the key, only empty squares are
+    # left, so all remaining symmetries give the same key.
+    while placed:
+        best = _EMPTY
+        survivors = []
+        for sym, i in candidates:
+            p = cells[sym[sq]]
+            if p != _EMPTY:
+                p, i = _STEPS[i][p] or _step(i, p)
+            if p < best:
+                best = p
+                survivors = [(sym, i)]
+            elif p == best:
+                survivors.append((sym, i))
+        key = key << 5 | best
+        candidates = survivors
+        sq += 1
+        if best != _EMPTY:
+            placed -= 1
+    key = key << 5*(16 - sq) | _EMPTY_TAILS[16 - sq]
+    sym, i = candidates[0]
+    return key, sym, _MAP_SETS[i][0]
+
+def canonical_key(state):
+    return canonical_form(state)[0]
+
+# Moves are (square, piece) pairs as used by the AI, where square is a
+# (row, col) tuple and either of them may be None.
+def to_canonical_move(move, sym, pmap):
+    square, piece = move
+    if square is not None:
+        sq = sym.index(4*square[0] + square[1])
+        square = (sq >> 2, sq & 3)
+    if piece is not None:
+        piece = pmap[piece]
+    return square, piece
+
+def from_canonical_move(move, sym, pmap):
+    square, piece = move
+    if square is not None:
+        sq = sym[4*square[0] + square[1]]
+        square = (sq >> 2, sq & 3)
+    if piece is not None:
+        piece = pmap.index(piece)
+    return square, piece
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+import argparse
+import mmap
+import random
+import struct
+from state import State
+from symmetry import canonical_form, to_canonical_move, from_canonical_move
+
+# Endgame tablebase.
+#
+# Holds exact results of endgame positions where a piece is held and at most
+# max_pieces pieces remain, keyed on their canonical form (see symmetry.py),
+# so one record serves all symmetric variants of a position. Results are
+# from the point of view of the player about to place the held piece.
+#
+# File format: a header (magic, max_pieces, number of records) followed by
+# fixed size records sorted by key, so the file can be memory-mapped and
+# searched with binary search without loading it:
+#   key       11 bytes, big-endian canonical key
+#   result     1 byte, result in the 2 low bits, distance in the others
+#   square     1 byte, best square (row*4 + col) in canonical orientation
+#   piece      1 byte, best piece in canonical orientation, or 16 if none
+# The distance is the number of placements until the game ends, counting
+# the one about to be made.
+#
+# Solving every endgame position is far out of reach (there are billions
+# even with only a few pieces left), so build() samples endgame positions
+# from random games, solves each of them exhaustively, and stores every
+# position visited while solving.
+
+WIN, DRAW, LOSS = 0, 1, 2
+
+_MAGIC = b"QTB1"
+_HEADER = struct.Struct(">4sBI")
+_KEY_SIZE = 11
+_RECORD_SIZE = _KEY_SIZE + 3
+_NO_PIECE = 16
+
+class Tablebase(object):
+    def __init__(self, path):
+        self._path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._max_pieces, self._size = _HEADER.unpack_from(self._map)
+        if magic != _MAGIC:
+            raise ValueError("Not a tablebase file: {}".format(path))
+
+    @property
+    def path(self):
+        return self._path
+
+    # Returns the highest number of remaining pieces of positions in the table
+    @property
+    def max_pieces(self):
+        return self._max_pieces
+
+    def __len__(self):
+        return self._size
+
+    def close(self):
+        self._map.close()
+
+    # Looks up the state, which must be holding a piece. Returns a tuple
+    # (result, distance, move), where move is the best (square, piece) pair
+    # for the state, or None if the state is not in the table.
+    def probe(self, state):
+        if len(state.pieces) > self._max_pieces or not state.is_holding():
+            return None
+        key, sym, pmap = canonical_form(state)
+        record = self._find(key.to_bytes(_KEY_SIZE, "big"))
+        if record is None:
+            return None
+        value, square, piece = record
+        move = ((square >> 2, square & 3),
+                piece if piece != _NO_PIECE else None)
+        return value & 3, value >> 2, from_canonical_move(move, sym, pmap)
+
+    def _find(self, key):
+        lo, hi = 0, self._size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset = _HEADER.size + mid*_RECORD_SIZE
+            mid_key = self._map[offset:offset + _KEY_SIZE]
+            if mid_key < key:
+                lo = mid + 1
+            elif mid_key > key:
+                hi = mid
+            else:
+                return tuple(self._map[offset + _KEY_SIZE:
+                                       offset + _RECORD_SIZE])
+        return None
+
+# Results compare by how good they are for the player they belong to:
+# quick wins, then draws, then slow losses.
+def _rank(result, distance):
+    if result == WIN:
+        return (2, -distance)
+    return (1 if result == DRAW else 0, distance)
+
+_FLIP = {WIN: LOSS, DRAW: DRAW, LOSS: WIN}
+
+# Solves the state exhaustively, with the state holding a piece. Stores the
+# result of every visited position in table, mapping canonical keys to
+# (result, distance, canonical move), and returns (result, distance, move).
+def _solve(state, table):
+    key, sym, pmap = canonical_form(state)
+    if key in table:
+        result, distance, move = table[key]
+        return result, distance, from_canonical_move(move, sym, pmap)
+    best = None
+    pieces = sorted(state.pieces)
+    for square in state.free_squares():
+        state.push_place(*square)
+        if state.has_winner():
+            outcomes = [(WIN, 1, (square, pieces[0] if pieces else None))]
+        elif not pieces:
+            outcomes = [(DRAW, 1, (square, None))]
+        else:
+            outcomes = []
+            for piece in pieces:
+                state.push_pick(piece)
+                result, distance, _ = _solve(state, table)
+                state.undo()
+                outcomes.append((_FLIP[result], distance + 1,
+                                 (square, piece)))
+        state.undo()
+        for outcome in outcomes:
+            if best is None or _rank(*outcome[:2]) > _rank(*best[:2]):
+                best = outcome
+        if best[:2] == (WIN, 1):
+            break
+    result, distance, move = best
+    table[key] = (result, distance, to_canonical_move(move, sym, pmap))
+    return best
+
+# Plays random moves until max_pieces pieces remain and a piece is held.
+# Returns None if the game was won before that.
+def _random_endgame(rnd, max_pieces):
+    state = State()
+    while True:
+        state.pick_piece(rnd.choice(sorted(state.pieces)))
+        if len(state.pieces) <= max_pieces:
+            return state
+        state.place_piece(*rnd.choice(state.free_squares()))
+        if state.has_winner():
+            return None
+
+# Builds a tablebase file at path, from the given number of sampled endgame
+# positions where a piece is held and max_pieces pieces remain.
+def build(path, max_pieces=4, positions=100, seed=None):
+    rnd = random.Random(seed)
+    table = {}
+    solved = 0
+    while solved < positions:
+        state = _random_endgame(rnd, max_pieces)
+        if state is not None:
+            _solve(state, table)
+            solved += 1
+    with open(path, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, max_pieces, len(table)))
+        for key in sorted(table):
+            result, distance, (square, piece) = table[key]
+            f.write(key.to_bytes(_KEY_SIZE, "big"))
+            f.write(bytes([distance << 2 | result,
+                           4*square[0] + square[1],
+                           piece if piece is not None else _NO_PIECE]))
+    return len(table)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Builds an endgame tablebase for the AI.")
+    parser.add_argument("path", help="file to write the tablebase to")
+    parser.add_argument("--pieces", type=int, default=4,
+                        help="max number of remaining pieces (default 4)")
+    parser.add_argument("--positions", type=int, default=100,
+                        help="number of endgame positions to sample and "
+                             "solve (default 100)")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="seed for sampling positions")
+    args = parser.parse_args()
+    size = build(args.path, args.pieces, args.positions, args.seed)
+    print("Wrote {} positions to {}".format(size, args.path))
+
+if __name__ == "__main__":
+    main()
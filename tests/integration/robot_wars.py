@@ -23,7 +23,7 @@ def HAL_9000_vs_Pumba(rounds):
             else:
                 hal_win_count += 1
         else:
-            draw_count += 1
+            draw_counter += 1
     return hal_win_count, pumba_win_count, draw_counter
 #print("Player {}: {} Wins".format(pumba_name, pumba_win_count))
  #   print("Player {}: {} Wins".format(hal_name, hal_win_count))
@@ -51,7 +51,7 @@ def HAL_9000_vs_Alfred(rounds):
             else:
                 hal_win_count += 1
         else:
-            draw_count += 1
+            draw_counter += 1
     return hal_win_count, alfred_win_count, draw_counter
     #print("Player {}: {} Wins".format(alfred_name, alfred_win_count))
     #print("Player {}: {} Wins".format(hal_name, hal_win_count))
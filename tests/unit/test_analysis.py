@@ -0,0 +1,63 @@
+import sys
+sys.path.append('../../')
+import json
+import os
+import tempfile
+import unittest
+import analysis
+import gamerecord
+
+# Row 1 gets pieces 0, 1 and 2, which have no 4 and no 8 bit, then player 2
+# hands over 4, which completes it, and player 1 places it elsewhere and
+# hands over 3, which also completes it, and player 2 wins with it.
+_MOVES = [0, 0, 1, 1, 2, 2, 4, 8, 3, 3]
+
+
+class AnalysisTestCase(unittest.TestCase):
+    def setUp(self):
+        fd, self.records = tempfile.mkstemp()
+        os.close(fd)
+        os.remove(self.records)
+        fd, self.output = tempfile.mkstemp()
+        os.close(fd)
+        self.record = gamerecord.GameRecord(("A", "B"), (None, None), None,
+                                            _MOVES)
+
+    def tearDown(self):
+        for path in (self.records, self.output):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_turns(self):
+        self.assertEqual(list(analysis._turns(_MOVES)),
+                         [(0, (None, 0)), (1, ((0, 0), 1)),
+                          (0, ((0, 1), 2)), (1, ((0, 2), 4)),
+                          (0, ((2, 0), 3)), (1, ((0, 3), None))])
+        # Cut short after a placement that didn't end the game
+        self.assertEqual(len(list(analysis._turns(_MOVES[:8]))), 4)
+
+    def test_analyze_game(self):
+        result = analysis.analyze_game(7, self.record)
+        self.assertEqual(result["game"], 7)
+        self.assertEqual(result["result"], gamerecord.WIN_P2)
+        self.assertEqual(result["turns"], 6)
+        blunders = result["blunders"]
+        self.assertEqual([(b["turn"], b["player"]) for b in blunders],
+                         [(3, "B"), (4, "A")])
+        self.assertEqual(blunders[0]["score"], "loss")
+        self.assertEqual(blunders[1]["best_score"], "win")
+        self.assertEqual(blunders[1]["best_move"][0], 3)
+
+    def test_run(self):
+        with gamerecord.GameRecordWriter(self.records) as writer:
+            for _ in range(3):
+                writer.write(self.record)
+        self.assertEqual(analysis.run(self.records, self.output,
+                                      workers=1), 3)
+        with open(self.output) as f:
+            results = [json.loads(line) for line in f]
+        self.assertEqual([r["game"] for r in results], [0, 1, 2])
+        self.assertEqual(len(results[2]["blunders"]), 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,361 @@
+import sys
+sys.path.append('../../')
+import random
+import time
+import unittest
+import gameengine
+import state
+
+
+def random_position(rnd, placed):
+    s = state.State()
+    while True:
+        for _ in range(placed):
+            s.pick_piece(rnd.choice(sorted(s.pieces)))
+            s.place_piece(*rnd.choice(s.free_squares()))
+        if not s.has_winner():
+            s.pick_piece(rnd.choice(sorted(s.pieces)))
+            return s
+        s = state.State()
+
+
+# Plain minimax with the same terminal rules and tie-breaking as the AI,
+# without pruning, ordering or transposition tables.
+def minimax(ai, node, depth, maximizing):
+    sign = 1 if maximizing else -1
+    if node.has_winner():
+        return -sign*gameengine.inf, depth
+    if node.is_draw():
+        return 0, depth
+    if not maximizing and ai._can_win(node):
+        return gameengine.inf*sign, depth
+    if depth == 0:
+        if ai._can_win(node):
+            return sign*gameengine.inf, depth
+        return ai._evaluate(node), 0
+    vals = []
+    for move in ai._moves(node):
+        ai._make(node, move)
+        vals.append(minimax(ai, node, depth-1, not maximizing))
+        ai._unmake(node, move)
+    best = max if maximizing else min
+    return best(vals, key=lambda v: gameengine._rank(*v))
+
+
+class AITestCase(unittest.TestCase):
+    def setUp(self):
+        self.rnd = random.Random(4)
+
+    def test_does_not_modify_state(self):
+        s = random_position(self.rnd, 8)
+        board, pieces, key = s.board, s.pieces, s.key
+        ai = gameengine.AI(gameengine.Difficulty.HIGH)
+        row, col = ai.choose_square(s)
+        self.assertIsNone(s.square(row, col))
+        self.assertEqual((s.board, s.pieces, s.key), (board, pieces, key))
+
+    def test_transposition_table_keeps_values(self):
+        for _ in range(10):
+            s = random_position(self.rnd, self.rnd.randint(9, 11))
+            ai = gameengine.AI(gameengine.Difficulty.HIGH)
+            depth = ai._determine_depth(s)
+            cold = ai._maximize(s.copy(), depth)[:2]
+            warm = ai._maximize(s.copy(), depth)[:2]
+            self.assertEqual(cold, warm)
+
+    def test_symmetric_tables_keep_values(self):
+        for _ in range(5):
+            s = random_position(self.rnd, self.rnd.randint(9, 11))
+            plain = gameengine.AI(gameengine.Difficulty.HIGH)
+            sym = gameengine.AI(gameengine.Difficulty.HIGH, symmetric=True)
+            depth = plain._determine_depth(s)
+            self.assertEqual(plain._maximize(s.copy(), depth)[:2],
+                             sym._maximize(s.copy(), depth)[:2])
+            row, col = sym.choose_square(s)
+            self.assertIsNone(s.square(row, col))
+
+    @unittest.skipIf(gameengine._numpy() is None, "NumPy is not installed")
+    def test_evaluate_batch_matches_evaluate(self):
+        ai = gameengine.AI(gameengine.Difficulty.HIGH)
+        states = [random_position(self.rnd, self.rnd.randint(0, 14))
+                  for _ in range(200)]
+        lines = gameengine.np.array([s.line_summaries() for s in states])
+        self.assertEqual(gameengine.evaluate_batch(lines).tolist(),
+                         [ai._evaluate(s) for s in states])
+
+    @unittest.skipIf(gameengine._numpy() is None, "NumPy is not installed")
+    def test_batched_search_keeps_values(self):
+        for _ in range(5):
+            s = random_position(self.rnd, self.rnd.randint(5, 9))
+            plain = gameengine.AI(gameengine.Difficulty.HIGH)
+            batched = gameengine.AI(gameengine.Difficulty.HIGH,
+                                    batch_leaves=True)
+            self.assertEqual(batched._maximize(s.copy(), 2)[:2],
+                             plain._maximize(s.copy(), 2)[:2])
+
+    def test_evaluate_move(self):
+        for _ in range(5):
+            s = random_position(self.rnd, self.rnd.randint(8, 11))
+            key = s.key
+            ai = gameengine.AI(gameengine.Difficulty.HIGH)
+            best, best_move, played = ai.evaluate_move(s, max_depth=2)
+            self.assertIsNone(played)
+            self.assertEqual(ai.evaluate_move(s, best_move, max_depth=2),
+                             (best, best_move, best))
+            for move in ai._moves(s):
+                _, _, played = ai.evaluate_move(s, move, max_depth=2)
+                self.assertLessEqual(played, best)
+            self.assertEqual(s.key, key)
+
+    def test_alpha_beta_matches_minimax(self):
+        for _ in range(10):
+            s = random_position(self.rnd, self.rnd.randint(8, 11))
+            ai = gameengine.AI(gameengine.Difficulty.HIGH)
+            depth = min(3, ai._determine_depth(s))
+            self.assertEqual(ai._maximize(s.copy(), depth)[:2],
+                             minimax(ai, s.copy(), depth, True))
+
+    def test_time_limit(self):
+        s = random_position(self.rnd, 3)
+        ai = gameengine.AI(gameengine.Difficulty.HIGH, time_limit=0.3)
+        start = time.monotonic()
+        row, col = ai.choose_square(s)
+        self.assertLess(time.monotonic() - start, 0.6)
+        self.assertIsNone(s.square(row, col))
+
+    def test_node_limit(self):
+        s = random_position(self.rnd, 5)
+        ai = gameengine.AI(gameengine.Difficulty.HIGH, node_limit=1000)
+        row, col = ai.choose_square(s)
+        self.assertIsNone(s.square(row, col))
+        self.assertLessEqual(ai._nodes, 1000 + ai._check_interval)
+
+    def test_iterative_deepening_solves_endgame(self):
+        for _ in range(5):
+            s = random_position(self.rnd, 10)
+            ai = gameengine.AI(gameengine.Difficulty.HIGH, time_limit=10)
+            depth = len(s.pieces) + 1
+            best = ai._maximize(s.copy(), depth)[:2]
+            move = ai._search(s)
+            child = s.copy()
+            ai._make(child, move)
+            self.assertEqual(ai._minimize(child, depth - 1)[:2], best)
+
+    def test_moves_are_permutations(self):
+        for n in (0, 1, 12, 240):
+            self.assertEqual(sorted(gameengine._shuffled(n)), list(range(n)))
+        ai = gameengine.AI(gameengine.Difficulty.HIGH)
+        for placed in (0, 7, 15):
+            s = random_position(self.rnd, placed)
+            moves = list(ai._moves(s))
+            self.assertEqual(len(moves), len(set(moves)))
+            ordered = list(ai._ordered_moves(s))
+            self.assertLessEqual(set(ordered), set(moves))
+            self.assertTrue(ordered)
+            # Every move that neither wins nor hands over a winning piece
+            for move in moves:
+                if move[0] is not None:
+                    s.push_place(*move[0])
+                    won = s.has_winner()
+                    s.undo()
+                    if won:
+                        continue
+                ai._make(s, move)
+                deadly = ai._can_win(s)
+                ai._unmake(s, move)
+                if not deadly:
+                    self.assertIn(move, ordered)
+            self.assertTrue(all(ai._is_legal(s, m) for m in moves))
+
+    def test_pack_position(self):
+        for placed in (0, 5, 12):
+            s = random_position(self.rnd, placed)
+            packed = gameengine.pack_position(s)
+            self.assertEqual(len(packed), 17)
+            t = gameengine.unpack_position(packed)
+            self.assertEqual((t.board, t.pieces, t.held_piece, t.key),
+                             (s.board, s.pieces, s.held_piece, s.key))
+
+    def test_parallel_search_keeps_values(self):
+        for _ in range(3):
+            s = random_position(self.rnd, self.rnd.randint(8, 10))
+            ai = gameengine.AI(gameengine.Difficulty.HIGH)
+            parallel = gameengine.AI(gameengine.Difficulty.HIGH, workers=2)
+            depth = min(3, ai._determine_depth(s))
+            self.assertEqual(parallel._parallel_maximize(s.copy(), depth)[:2],
+                             ai._maximize(s.copy(), depth)[:2])
+            row, col = parallel.choose_square(s)
+            self.assertIsNone(s.square(row, col))
+
+    def test_stop_pondering(self):
+        s = random_position(self.rnd, 3)
+        ai = gameengine.AI(gameengine.Difficulty.HIGH)
+        ai.ponder(s)
+        time.sleep(0.2)
+        thread = ai._ponder_thread
+        ai.stop_pondering()
+        self.assertFalse(thread.is_alive())
+        row, col = ai.choose_square(s)
+        self.assertIsNone(s.square(row, col))
+
+    def test_ponder_fills_tables(self):
+        s = random_position(self.rnd, 9)
+        ai = gameengine.AI(gameengine.Difficulty.HIGH)
+        ai.ponder(s)
+        ai._ponder_thread.join(5)
+        ai.stop_pondering()
+        # Every reply has been searched, so the search after any of them
+        # is answered from the table
+        for reply in ai._moves(s):
+            node = s.copy()
+            ai._make(node, reply)
+            if node.has_winner() or node.is_draw():
+                continue
+            depth = ai._determine_depth(node)
+            ai._nodes = 0
+            pondered = ai._maximize(node.copy(), depth)[:2]
+            self.assertEqual(ai._nodes, 1)
+            fresh = gameengine.AI(gameengine.Difficulty.HIGH)
+            self.assertEqual(pondered, fresh._maximize(node, depth)[:2])
+
+    def test_choose_moves(self):
+        ai = gameengine.AI(gameengine.Difficulty.HIGH)
+        states = [random_position(self.rnd, placed)
+                  for placed in (0, 4, 8, 11, 13)]
+        for s in states[:3]:
+            s.place_piece(*s.free_squares()[0])
+        moves = ai.choose_moves(states)
+        for s, move in zip(states, moves):
+            if s.is_holding():
+                self.assertIn(move, s.free_squares())
+            else:
+                self.assertIn(move, s.pieces)
+
+    def test_choose_moves_maps_symmetric_positions(self):
+        ai = gameengine.AI(gameengine.Difficulty.HIGH, book=None)
+        s = random_position(self.rnd, 5)
+        # The same position rotated, with every piece complemented
+        rotated = state.State([[None if p is None else 0b1111 - p
+                                for p in col[::-1]]
+                               for col in zip(*s.board)],
+                              {0b1111 - p for p in s.pieces},
+                              0b1111 - s.held_piece)
+        square, rotated_square = ai.choose_moves([s, rotated])
+        self.assertEqual(rotated_square, (square[1], 3 - square[0]))
+
+    def test_piece_from_square_search(self):
+        ai = gameengine.AI(gameengine.Difficulty.HIGH, book=None)
+        s = random_position(self.rnd, 6)
+        while ai._can_win(s):
+            s = random_position(self.rnd, 6)
+        other = s.copy()
+        square = ai.choose_square(s)
+        s.place_piece(*square)
+        piece = ai.choose_piece(s)
+        self.assertEqual(ai.last_stats.source, "principal")
+        self.assertIn(piece, s.pieces)
+        # Only for the position right after the square search
+        ai.choose_square(other)
+        other.place_piece(*[sq for sq in other.free_squares()
+                            if sq != ai.choose_square(other)][0])
+        self.assertIn(ai.choose_piece(other), other.pieces)
+        self.assertEqual(ai.last_stats.source, "search")
+
+    def test_search_stats(self):
+        ai = gameengine.AI(gameengine.Difficulty.HIGH)
+        s = random_position(self.rnd, 6)
+        while ai._can_win(s):
+            s = random_position(self.rnd, 6)
+        ai._stats = gameengine.SearchStats()
+        self.assertIsNone(ai.last_stats)
+        ai._search(s)
+        stats = ai.last_stats
+        self.assertEqual(stats.source, "search")
+        self.assertEqual(stats.depth, ai._determine_depth(s))
+        self.assertGreater(stats.nodes, 0)
+        self.assertGreater(stats.leaves, 0)
+        self.assertGreater(stats.can_win_calls, 0)
+        self.assertGreaterEqual(stats.cache_probes, stats.cache_hits)
+        self.assertGreater(stats.elapsed, 0)
+        self.assertEqual(stats.as_dict()["nodes_per_second"],
+                         stats.nodes / stats.elapsed)
+        # A second search of the same position is mostly table hits
+        ai._search(s)
+        self.assertGreater(ai.last_stats.cache_hits, 0)
+        self.assertLess(ai.last_stats.nodes, stats.nodes)
+
+    def test_takes_winning_square(self):
+        s = state.State([[12, 8, 14, None],
+                         [None, None, None, None],
+                         [None, None, None, None],
+                         [None, None, None, None]],
+                        set(range(16)) - {12, 8, 14, 15}, 15)
+        ai = gameengine.AI(gameengine.Difficulty.HIGH)
+        self.assertEqual(ai.choose_square(s), (0, 3))
+
+    def test_clock_budget(self):
+        s = state.State()
+        # 16 picks and 16 placements left, half of them ours
+        self.assertEqual(gameengine.clock_budget(s, 32), 2)
+        self.assertEqual(gameengine.clock_budget(s, 32, 1), 3)
+        # Never more than half of what is left
+        self.assertEqual(gameengine.clock_budget(s, 1, 5), 0.5)
+        s.pick_piece(0)
+        self.assertEqual(gameengine.clock_budget(s, 32), 2)
+
+
+class MCTSTestCase(unittest.TestCase):
+    def setUp(self):
+        random.seed(8)
+        self.rnd = random.Random(8)
+
+    def test_legal_moves(self):
+        mcts = gameengine.MCTS(gameengine.Difficulty.LOW)
+        for placed in (0, 6, 12, 15):
+            s = random_position(self.rnd, placed)
+            board, key = s.board, s.key
+            self.assertIn(mcts.choose_square(s), s.free_squares())
+            self.assertEqual((s.board, s.key), (board, key))
+            s.place_piece(*s.free_squares()[0])
+            if s.pieces and not s.has_winner():
+                self.assertIn(mcts.choose_piece(s), s.pieces)
+
+    def test_takes_winning_square(self):
+        s = state.State([[12, 8, 14, None],
+                         [None, None, None, None],
+                         [None, None, None, None],
+                         [None, None, None, None]],
+                        set(range(16)) - {12, 8, 14, 15}, 15)
+        mcts = gameengine.MCTS(gameengine.Difficulty.LOW)
+        self.assertEqual(mcts.choose_square(s), (0, 3))
+
+    def test_avoids_giving_winning_piece(self):
+        s = state.State([[12, 8, 14, None],
+                         [None, None, None, None],
+                         [None, None, None, None],
+                         [None, None, None, None]],
+                        set(range(16)) - {12, 8, 14})
+        mcts = gameengine.MCTS(gameengine.Difficulty.LOW)
+        s.pick_piece(mcts.choose_piece(s))
+        self.assertFalse(gameengine.AI(gameengine.Difficulty.HIGH)
+                         ._can_win(s))
+
+    def test_playouts(self):
+        s = random_position(self.rnd, 10)
+        results = [gameengine._playout(s) for _ in range(50)]
+        self.assertTrue(set(results) <= {0, 0.5, 1})
+        if gameengine._numpy() is not None:
+            total = gameengine._playouts_batch(s, 50)
+            self.assertTrue(0 <= total <= 50)
+
+    def test_time_limit(self):
+        s = random_position(self.rnd, 0)
+        mcts = gameengine.MCTS(gameengine.Difficulty.HIGH, iterations=10**6,
+                               time_limit=0.3)
+        start = time.monotonic()
+        self.assertIn(mcts.choose_square(s), s.free_squares())
+        self.assertLess(time.monotonic() - start, 0.6)
+
+
+if __name__ == "__main__":
+    unittest.main()
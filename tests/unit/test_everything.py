@@ -3,7 +3,18 @@ sys.path.append('../../')
 import state
 import unittest
 import importlib
+import io
+import os
+import socket
+import tempfile
+import threading
+import time
+from contextlib import redirect_stdout
+import cmdgame
+import gameengine
+import gamerecord
 import gameplatform
+import player
 
 
 class GameTestCase(unittest.TestCase):
@@ -13,26 +24,26 @@ class GameTestCase(unittest.TestCase):
 
     def test_init_game(self):
         self.assertEqual(len(self.g._state._pieces), 16)
-        self.assertEqual(self.g._state.board, [[None, None, None, None],
-                                          [None, None, None, None],
-                                          [None, None, None, None],
-                                          [None, None, None, None]])
+        self.assertEqual(self.g._state.board, ((None, None, None, None),
+                                          (None, None, None, None),
+                                          (None, None, None, None),
+                                          (None, None, None, None)))
 
         
     def test_game_over(self):
     
-        self.g._state._board = [[12, 8, 14, 15],
+        self.g._state.board = [[12, 8, 14, 15],
                     [None, None, None, None],
                     [None, None, None, None],
                     [None, None, None, None]]
         self.assertTrue(self.g._state.has_winner())
         
-        self.g._state._board = [[0b0100, 0b1000, 0b1110, 0b1111],
+        self.g._state.board = [[0b0100, 0b1000, 0b1110, 0b1111],
                     [None, 0b1100, None, None],
                     [None, None, None, None],
                     [None, None, None, None]]
         self.assertFalse(self.g._state.has_winner())
-        self.g._state._board = [[12, None, None, None],
+        self.g._state.board = [[12, None, None, None],
                     [8, None, None, None],
                     [14, None, None, None],
                     [15, None, None, None]]
@@ -76,10 +87,10 @@ class GameTestCase(unittest.TestCase):
                     [None, None, None, None],
                     [None, None, None, None]]
         s.place_piece(0, 0)
-        self.assertEqual(s.board, [[1, None, None, None],
-                    [None, None, None, None],
-                    [None, None, None, None],
-                    [None, None, None, None]])
+        self.assertEqual(s.board, ((1, None, None, None),
+                    (None, None, None, None),
+                    (None, None, None, None),
+                    (None, None, None, None)))
         
         s._held_piece = 11
         s.board = [[0b1111, 0b1000, 0b1110, 0b0100],
@@ -87,10 +98,10 @@ class GameTestCase(unittest.TestCase):
                     [0b0001, 0b0011, 0b0101, 0b1001],
                     [None, 0b1101, 0b1010, 0b0110]]
         s.place_piece(3, 0)
-        self.assertEqual(s.board, [[0b1111, 0b1000, 0b1110, 0b0100],
-                    [0b0000, 0b0010, 0b1100, 0b0111],
-                    [0b0001, 0b0011, 0b0101, 0b1001],
-                    [0b1011, 0b1101, 0b1010, 0b0110]])
+        self.assertEqual(s.board, ((0b1111, 0b1000, 0b1110, 0b0100),
+                    (0b0000, 0b0010, 0b1100, 0b0111),
+                    (0b0001, 0b0011, 0b0101, 0b1001),
+                    (0b1011, 0b1101, 0b1010, 0b0110)))
     def test_hold(self):
         s = self.g._state
         self.assertFalse(s.is_holding())
@@ -150,5 +161,232 @@ class GameTestCase(unittest.TestCase):
                           [0b0100, 0b0111, 0b1001, 0b0110]], tm)
 
 
+class RendererTestCase(unittest.TestCase):
+    def play(self, renderer=None):
+        p1 = player.AIPlayer("A", gameengine.Difficulty.LOW)
+        p2 = player.AIPlayer("B", gameengine.Difficulty.LOW)
+        g = gameplatform.Game(p1, p2, renderer=renderer)
+        out = io.StringIO()
+        with redirect_stdout(out):
+            g.start()
+        return out.getvalue()
+
+    def test_null_renderer(self):
+        self.assertEqual(self.play(gameplatform.NullRenderer()), "")
+
+    def test_buffered_renderer(self):
+        r = gameplatform.BufferedRenderer()
+        self.assertEqual(self.play(r), "")
+        self.assertIn("Welcome to the game between AI A and AI B!", r.text)
+        self.assertIn("AI A chose piece", r.text)
+        self.assertIn("AI B chose square", r.text)
+        self.assertTrue(r.text.rstrip().endswith(("wins!", "Draw!")))
+        r.clear()
+        self.assertEqual(r.text, "")
+
+    def test_console_renderer(self):
+        text = self.play()
+        self.assertIn("PIECES LEFT:", text)
+        self.assertIn("AI A chose piece", text)
+
+class FakeTimer(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+# Plays the first free piece and square, taking seconds of the timer for
+# every move (or sleeping without one), and keeps the clock times it was
+# given
+class SlowPlayer(player.AbsPlayer):
+    def __init__(self, name, timer, seconds):
+        super().__init__(name)
+        self._timer = timer
+        self._seconds = seconds
+        self.clocks = []
+
+    def _think(self, clock):
+        if self._timer is None:
+            time.sleep(self._seconds)
+        else:
+            self._timer.now += self._seconds
+        self.clocks.append(clock)
+
+    def prompt_piece(self, state, time_limit=None, clock=None):
+        self._think(clock)
+        return min(state.pieces)
+
+    def prompt_square(self, state, time_limit=None, clock=None):
+        self._think(clock)
+        return state.free_squares()[0]
+
+
+class QuittingPlayer(player.AbsPlayer):
+    def prompt_piece(self, state, time_limit=None, clock=None):
+        raise player.QuitException()
+
+    def prompt_square(self, state, time_limit=None, clock=None):
+        raise player.QuitException()
+
+
+# Never makes its moves, until released
+class BlockingPlayer(player.AbsPlayer):
+    def __init__(self, name):
+        super().__init__(name)
+        self.release = threading.Event()
+
+    def prompt_piece(self, state, time_limit=None, clock=None):
+        self.release.wait()
+        return min(state.pieces)
+
+    def prompt_square(self, state, time_limit=None, clock=None):
+        self.release.wait()
+        return state.free_squares()[0]
+
+
+class QuitTestCase(unittest.TestCase):
+    def test_quit_stops_pondering(self):
+        for game_cls in (gameplatform.Game, cmdgame.Game):
+            ai = player.AIPlayer("A", gameengine.Difficulty.HIGH,
+                                 ponder=True)
+            g = game_cls(ai, QuittingPlayer("Q"),
+                         renderer=gameplatform.NullRenderer())
+            with self.assertRaises(player.QuitException):
+                g.start()
+            self.assertIsNone(ai._ai._ponder_thread)
+
+
+class ClockTestCase(unittest.TestCase):
+    def setUp(self):
+        self.timer = FakeTimer()
+
+    def test_clock(self):
+        c = gameplatform.Clock(5, 1, timer=self.timer)
+        c.start(0)
+        self.timer.now += 2
+        self.assertEqual(c.remaining(0), 3)
+        self.assertEqual(c.remaining(1), 5)
+        self.assertTrue(c.stop())
+        self.assertEqual(c.remaining(0), 4)
+        c.start(1)
+        self.timer.now += 6
+        self.assertFalse(c.stop())
+        self.assertEqual(c.flagged, 1)
+        self.assertEqual(c.remaining(1), 0)
+        c.reset()
+        self.assertEqual((c.remaining(0), c.remaining(1)), (5, 5))
+        self.assertIsNone(c.flagged)
+
+    def test_per_move(self):
+        c = gameplatform.Clock(5, per_move=True, timer=self.timer)
+        for _ in range(3):
+            c.start(0)
+            self.timer.now += 4
+            self.assertTrue(c.stop())
+        self.assertEqual(c.remaining(0), 5)
+
+    def test_flag_fall(self):
+        fast = SlowPlayer("Fast", self.timer, 0.5)
+        slow = SlowPlayer("Slow", self.timer, 4)
+        g = gameplatform.Game(fast, slow,
+                              renderer=gameplatform.BufferedRenderer(),
+                              clock=gameplatform.Clock(10, 1,
+                                                       timer=self.timer))
+        g.start()
+        self.assertTrue(g.timeout)
+        self.assertIs(g.winner, fast)
+        self.assertIs(g.loser, slow)
+        self.assertIn("Slow ran out of time.", g.renderer.text)
+        # Slow lost 3 seconds a move, net of the increment, and its flag
+        # fell on its fourth move
+        self.assertEqual(slow.clocks, [(10, 1), (7, 1), (4, 1), (1, 1)])
+        self.assertEqual(fast.clocks, [(10, 1), (10.5, 1), (11, 1)])
+        self.assertEqual(g.clock.flagged, 1)
+        g.reset()
+        self.assertFalse(g.timeout)
+        self.assertEqual(g.clock.remaining(1), 10)
+
+    def test_recorded_time_loss(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        os.remove(path)
+        try:
+            fast = SlowPlayer("Fast", self.timer, 0.5)
+            slow = SlowPlayer("Slow", self.timer, 4)
+            g = gameplatform.Game(slow, fast,
+                                  renderer=gameplatform.NullRenderer(),
+                                  record=path,
+                                  clock=gameplatform.Clock(10, 1,
+                                                           timer=self.timer))
+            g.start()
+            self.assertIs(g.winner, fast)
+            record, = gamerecord.read(path)
+            self.assertEqual(record.result, gamerecord.WIN_P2)
+        finally:
+            os.remove(path)
+
+    def test_start_with_timer(self):
+        g = gameplatform.Game(SlowPlayer("A", None, 0),
+                              SlowPlayer("B", None, 0),
+                              renderer=gameplatform.NullRenderer())
+        self.assertEqual(g.start_with_timer(1), "Game Over")
+        self.assertIsNone(g.clock)
+        g = gameplatform.Game(SlowPlayer("A", None, 0.02),
+                              SlowPlayer("B", None, 0.02),
+                              renderer=gameplatform.NullRenderer())
+        self.assertEqual(g.start_with_timer(0.01), "Timeout")
+        self.assertEqual(g.get_winner(), "B")
+
+    def test_blocked_player_loses_on_time(self):
+        blocked = BlockingPlayer("Blocked")
+        try:
+            for game_cls in (gameplatform.Game, cmdgame.Game):
+                g = game_cls(SlowPlayer("Fast", None, 0), blocked,
+                             renderer=gameplatform.BufferedRenderer())
+                self.assertEqual(g.start_with_timer(0.2), "Timeout")
+                self.assertEqual(g.winner.name, "Fast")
+                self.assertIs(g.loser, blocked)
+                self.assertIn("Blocked ran out of time.", g.renderer.text)
+            g = gameplatform.Game(blocked, SlowPlayer("Fast", None, 0),
+                                  renderer=gameplatform.NullRenderer(),
+                                  clock=gameplatform.Clock(0.2, 1))
+            g.start()
+            self.assertTrue(g.timeout)
+            self.assertIs(g.loser, blocked)
+        finally:
+            blocked.release.set()
+
+    def test_network_opponent_on_clock(self):
+        a, b = socket.socketpair()
+        try:
+            opp = player.NetworkOpponent("Remote", a,
+                                         gameplatform.NullRenderer())
+            g = gameplatform.Game(SlowPlayer("Local", None, 0), opp,
+                                  renderer=gameplatform.NullRenderer())
+            self.assertEqual(g.start_with_timer(0.2), "Timeout")
+            self.assertIs(g.loser, opp)
+            # The opponent gives up waiting at the same time as the game,
+            # and then puts the socket back as it was
+            for _ in range(100):
+                if a.gettimeout() is None:
+                    break
+                time.sleep(0.01)
+            self.assertIsNone(a.gettimeout())
+        finally:
+            a.close()
+            b.close()
+
+    def test_ai_on_clock(self):
+        p1 = player.AIPlayer("A", gameengine.Difficulty.HIGH)
+        p2 = player.AIPlayer("B", gameengine.Difficulty.HIGH)
+        g = gameplatform.Game(p1, p2, renderer=gameplatform.NullRenderer(),
+                              clock=gameplatform.Clock(2))
+        g.start()
+        self.assertFalse(g.timeout)
+        self.assertGreater(g.clock.remaining(0), 0)
+        self.assertGreater(g.clock.remaining(1), 0)
+
 if __name__ == "__main__":    
     unittest.main() 
@@ -0,0 +1,111 @@
+import sys
+sys.path.append('../../')
+import os
+import tempfile
+import unittest
+import gamerecord
+import gameplatform
+import player
+from gameengine import Difficulty
+
+
+class GameRecordTestCase(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        os.remove(self.path)
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def play(self, seed=None):
+        p1 = player.AIPlayer("A", Difficulty.LOW)
+        p2 = player.AIPlayer("B", Difficulty.MEDIUM)
+        g = gameplatform.Game(p1, p2, renderer=gameplatform.NullRenderer(),
+                              record=self.path, seed=seed)
+        g.start()
+        return g
+
+    def test_result(self):
+        # Player 2 places the first piece, player 1 the second
+        self.assertEqual(gamerecord.GameRecord(
+            ("a", "b"), (None, None), None, [0, 0]).result,
+            gamerecord.UNFINISHED)
+        moves = [0, 0, 1, 1, 2, 2, 3, 3]
+        self.assertEqual(gamerecord.GameRecord(
+            ("a", "b"), (None, None), None, moves).result,
+            gamerecord.WIN_P1)
+        moves = [0, 0, 1, 1, 2, 2, 4, 8, 3, 3]
+        self.assertEqual(gamerecord.GameRecord(
+            ("a", "b"), (None, None), None, moves).result,
+            gamerecord.WIN_P2)
+
+    def test_write_read(self):
+        records = [
+            gamerecord.GameRecord(("Ann", "Bö"), (None, Difficulty.HIGH),
+                                  None, [3, 5, 7, 9]),
+            gamerecord.GameRecord(("AI X", "AI Y"), (1, 2), 2**40,
+                                  [0, 0, 1, 1, 2, 2, 3, 3])]
+        with gamerecord.GameRecordWriter(self.path) as writer:
+            writer.write(records[0])
+        gamerecord.append(self.path, records[1])
+        self.assertEqual(list(gamerecord.read(self.path)), records)
+        # Header and names and moves, after the magic
+        self.assertEqual(os.path.getsize(self.path),
+                         4 + 14 + 6 + 4 + 14 + 8 + 8)
+
+    def test_long_names(self):
+        record = gamerecord.GameRecord(("é"*200, "b"*300), (None, None),
+                                       None, [0, 0])
+        gamerecord.append(self.path, record)
+        gamerecord.append(self.path, record)
+        records = list(gamerecord.read(self.path))
+        self.assertEqual(len(records), 2)
+        self.assertEqual(records[1].players, ("é"*127, "b"*255))
+        self.assertEqual(records[1].moves, record.moves)
+
+    def test_bad_seed(self):
+        for seed in (-1, 2**64 - 1, 2**64, 1.5):
+            with self.assertRaises(ValueError):
+                gamerecord.GameRecord(("a", "b"), (None, None), seed, [])
+            with self.assertRaises(ValueError):
+                gameplatform.Game(record=self.path, seed=seed)
+        self.assertEqual(gamerecord.GameRecord(
+            ("a", "b"), (None, None), gamerecord.MAX_SEED, []).seed,
+            gamerecord.MAX_SEED)
+
+    def test_game_records(self):
+        games = [self.play() for _ in range(3)]
+        records = list(gamerecord.read(self.path))
+        self.assertEqual(len(records), 3)
+        for g, r in zip(games, records):
+            self.assertEqual(r.players, ("AI A", "AI B"))
+            self.assertEqual(r.difficulties,
+                             (Difficulty.LOW, Difficulty.MEDIUM))
+            if g.winner is None:
+                self.assertEqual(r.result, gamerecord.DRAW)
+            else:
+                self.assertEqual(r.result, gamerecord.WIN_P1
+                                 if g.winner.name == "AI A"
+                                 else gamerecord.WIN_P2)
+            for state, move in r.replay():
+                pass
+            # The generator applied the last move when it finished
+            self.assertEqual(state.board, g._state.board)
+
+    def test_seed(self):
+        self.play(seed=5)
+        self.play(seed=5)
+        first, second = gamerecord.read(self.path)
+        self.assertEqual(first.seed, 5)
+        self.assertEqual(first.moves, second.moves)
+
+    def test_not_a_record_file(self):
+        with open(self.path, "wb") as f:
+            f.write(b"nope")
+        with self.assertRaises(ValueError):
+            list(gamerecord.read(self.path))
+
+if __name__ == '__main__':
+    unittest.main()
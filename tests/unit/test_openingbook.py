@@ -0,0 +1,53 @@
+import sys
+sys.path.append('../../')
+import os
+import tempfile
+import unittest
+import gameengine
+import openingbook
+import state
+
+
+class OpeningBookTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        fd, cls.path = tempfile.mkstemp()
+        os.close(fd)
+        openingbook.build(cls.path, placed=1, depth=1)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.path)
+
+    def test_lookup(self):
+        s = state.State()
+        square, piece = openingbook.lookup(s, self.path)
+        self.assertIsNone(square)
+        self.assertIn(piece, s.pieces)
+        for held in (0, 9):
+            for row, col in ((0, 0), (1, 2)):
+                s = state.State()
+                s.pick_piece(held)
+                square, piece = openingbook.lookup(s, self.path)
+                self.assertIn(square, s.free_squares())
+                s.place_piece(row, col)
+                square, piece = openingbook.lookup(s, self.path)
+                self.assertIn(piece, s.pieces)
+                s.pick_piece(piece)
+                square, _ = openingbook.lookup(s, self.path)
+                s.place_piece(*square)
+                self.assertIsNone(openingbook.lookup(s, self.path))
+
+    def test_missing_book(self):
+        self.assertIsNone(openingbook.lookup(state.State(),
+                                             self.path + ".missing"))
+
+    def test_ai_plays_book_moves(self):
+        s = state.State()
+        s.pick_piece(6)
+        ai = gameengine.AI(gameengine.Difficulty.HIGH, book=self.path)
+        self.assertEqual(ai._search(s), openingbook.lookup(s, self.path))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import sys
+sys.path.append('../../')
+import io
+import json
+import os
+import socket
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+import gameengine
+import gameplatform
+import player
+import state
+
+
+class AIPlayerTestCase(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_stats_log(self):
+        p = player.AIPlayer("Bot", gameengine.Difficulty.HIGH,
+                            stats_log=self.path)
+        self.assertIsNone(p.stats)
+        s = state.State()
+        with redirect_stdout(io.StringIO()):
+            for _ in range(3):
+                s.pick_piece(p.prompt_piece(s))
+                self.assertIsInstance(p.stats, gameengine.SearchStats)
+                s.place_piece(*p.prompt_square(s))
+        with open(self.path) as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual([r["kind"] for r in records], ["piece", "square"]*3)
+        self.assertEqual(len(records[-1]["move"]), 2)
+        for record in records:
+            self.assertEqual(record["player"], "AI Bot")
+            self.assertIn(record["source"],
+                          ("search", "book", "principal", "random"))
+            self.assertIn("nodes_per_second", record)
+
+    def test_mcts_stats(self):
+        p = player.AIPlayer("Bot", gameengine.Difficulty.LOW,
+                            engine=gameengine.Engine.MCTS)
+        s = state.State()
+        with redirect_stdout(io.StringIO()):
+            p.prompt_piece(s)
+        self.assertEqual(p.stats.nodes, 25)
+        self.assertGreater(p.stats.leaves, 0)
+
+    def test_network_ai_options(self):
+        renderer = gameplatform.NullRenderer()
+        sock, opp_sock = socket.socketpair()
+        self.addCleanup(sock.close)
+        self.addCleanup(opp_sock.close)
+        p = player.NetworkAIPlayer("Bot", gameengine.Difficulty.HIGH, sock,
+                                   stats_log=self.path, renderer=renderer)
+        self.assertIs(p.renderer, renderer)
+        piece = p.prompt_piece(state.State())
+        self.assertEqual(int(opp_sock.recv(64)), piece)
+        with open(self.path) as f:
+            self.assertEqual(json.loads(f.readline())["kind"], "piece")
+
+
+
+class HumanPlayerTestCase(unittest.TestCase):
+    def setUp(self):
+        read, self.write = os.pipe()
+        self.stdin = sys.stdin
+        sys.stdin = os.fdopen(read)
+
+    def tearDown(self):
+        sys.stdin.close()
+        sys.stdin = self.stdin
+        os.close(self.write)
+
+    def test_input(self):
+        p = player.HumanPlayer("H")
+        os.write(self.write, b"x\n3\n")
+        with redirect_stdout(io.StringIO()):
+            self.assertEqual(p.prompt_piece(state.State(), 1), 2)
+
+    def test_out_of_time(self):
+        p = player.HumanPlayer("H")
+        with redirect_stdout(io.StringIO()):
+            with self.assertRaises(gameplatform.OutOfTimeException):
+                p.prompt_square(state.State(), clock=(0.05, 0))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+import sys
+sys.path.append('../../')
+import json
+import os
+import tempfile
+import unittest
+from gameengine import Difficulty, Engine
+import selfplay
+
+
+class SelfPlayTestCase(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_play_game(self):
+        low = (Difficulty.LOW, Engine.MINIMAX)
+        result = selfplay.play_game((1, low, low, None, 7))
+        self.assertEqual(result["game"], 1)
+        self.assertEqual(result["first"], "p2")
+        self.assertIn(result["winner"], ("p1", "p2", None))
+        self.assertEqual(result["moves"], len(result["move_times"]))
+        self.assertEqual(result["moves"] % 2, 0)
+        again = selfplay.play_game((1, low, low, None, 7))
+        self.assertEqual((result["winner"], result["moves"]),
+                         (again["winner"], again["moves"]))
+
+    def test_run(self):
+        low = (Difficulty.LOW, Engine.MINIMAX)
+        stats = selfplay.run(4, low, low, self.path, workers=2, seed=3)
+        self.assertEqual(stats["games"], 4)
+        self.assertAlmostEqual(stats["p1_win_rate"] + stats["p2_win_rate"]
+                               + stats["draw_rate"], 1)
+        with open(self.path) as f:
+            results = [json.loads(line) for line in f]
+        self.assertEqual(sorted(r["game"] for r in results), [0, 1, 2, 3])
+        self.assertEqual(sum(r["moves"] for r in results) / 4,
+                         stats["average_moves"])
+
+if __name__ == '__main__':
+    unittest.main()
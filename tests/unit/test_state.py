@@ -0,0 +1,231 @@
+import sys
+sys.path.append('../../')
+import random
+import unittest
+from functools import reduce
+from operator import or_
+import state
+
+
+class BitStateTestCase(unittest.TestCase):
+    def setUp(self):
+        self.s = state.BitState()
+
+    def test_init_state(self):
+        self.assertEqual(self.s.pieces, set(range(16)))
+        self.assertEqual(self.s.board, ((None,)*4,)*4)
+        self.assertEqual(len(self.s.free_squares()), 16)
+        self.assertFalse(self.s.is_holding())
+
+    def test_pick_place(self):
+        self.s.pick_piece(11)
+        self.assertEqual(self.s.held_piece, 11)
+        self.assertRaises(ValueError, self.s.pick_piece, 3)
+        self.s.place_piece(2, 1)
+        self.assertEqual(self.s.square(2, 1), 11)
+        self.assertNotIn((2, 1), self.s.free_squares())
+        self.assertRaises(ValueError, self.s.pick_piece, 11)
+        self.s.pick_piece(0)
+        self.assertRaises(ValueError, self.s.place_piece, 2, 1)
+
+    def test_has_winner(self):
+        self.s.board = [[12, 8, 14, 15],
+                        [None, None, None, None],
+                        [None, None, None, None],
+                        [None, None, None, None]]
+        self.assertTrue(self.s.has_winner())
+        self.s.board = [[0b0100, None, None, None],
+                        [None, 0b1000, None, None],
+                        [None, None, 0b1110, None],
+                        [None, None, None, 0b0001]]
+        self.assertFalse(self.s.has_winner())
+        self.s.board = [[None, None, None, 0b0000],
+                        [None, None, 0b0010, None],
+                        [None, 0b1000, None, None],
+                        [0b0100, None, None, None]]
+        self.assertTrue(self.s.has_winner())
+
+    def test_no_reference_leak(self):
+        b = [list(row) for row in self.s.board]
+        self.s.board = b
+        b[0][0] = 3
+        ps = set(self.s.pieces)
+        self.s.pieces = ps
+        ps.clear()
+        self.assertIsNone(self.s.square(0, 0))
+        self.assertEqual(len(self.s.pieces), 16)
+        c = self.s.copy()
+        c.pick_piece(3)
+        c.place_piece(0, 0)
+        self.assertIsNone(self.s.square(0, 0))
+        self.assertIn(3, self.s.pieces)
+
+    def test_matches_state(self):
+        rnd = random.Random(1)
+        for _ in range(50):
+            s, b = state.State(), state.BitState()
+            while not s.has_winner() and not s.is_draw():
+                piece = rnd.choice(sorted(s.pieces))
+                s.pick_piece(piece)
+                b.pick_piece(piece)
+                row, col = rnd.choice(s.free_squares())
+                s.place_piece(row, col)
+                b.place_piece(row, col)
+                self.assertEqual(s.board, b.board)
+                self.assertEqual(s.pieces, b.pieces)
+                self.assertEqual(s.free_squares(), b.free_squares())
+                self.assertEqual(s.get_vectors(), b.get_vectors())
+                self.assertEqual(s.has_winner(), b.has_winner())
+                self.assertEqual(s.is_draw(), b.is_draw())
+                self.assertEqual(s.line_summaries(), b.line_summaries())
+
+
+class LineSummaryTestCase(unittest.TestCase):
+    def summarize(self, vec):
+        pieces = [p for p in vec if p is not None]
+        ands, andnots = 0b1111, 0b1111
+        for p in pieces:
+            ands &= p
+            andnots &= 0b1111 - p
+        return len(pieces) << 8 | ands << 4 | andnots
+
+    def test_summaries(self):
+        rnd = random.Random(5)
+        for cls in (state.State, state.BitState):
+            for _ in range(20):
+                s = cls()
+                while not s.has_winner() and not s.is_draw():
+                    s.push_pick(rnd.choice(sorted(s.pieces)))
+                    s.push_place(*rnd.choice(s.free_squares()))
+                    self.assertEqual(s.line_summaries(),
+                                     tuple(map(self.summarize,
+                                               s.get_vectors())))
+                    self.assertEqual(s.line_summaries(),
+                                     cls(s.board).line_summaries())
+                s.undo()
+                s.undo()
+                self.assertEqual(s.line_summaries(),
+                                 tuple(map(self.summarize, s.get_vectors())))
+
+
+    def test_deadly_pieces(self):
+        rnd = random.Random(6)
+        for cls in (state.State, state.BitState):
+            for _ in range(20):
+                s = cls()
+                while not s.has_winner() and not s.is_draw():
+                    deadly = 0
+                    for piece in range(16):
+                        for row, col in s.free_squares():
+                            t = cls(s.board, held_piece=piece)
+                            t.place_piece(row, col)
+                            if t.has_winner():
+                                deadly |= 1 << piece
+                    self.assertEqual(s.deadly_pieces(), deadly)
+                    self.assertEqual(reduce(or_, s.line_completers()), deadly)
+                    s.pick_piece(rnd.choice(sorted(s.pieces)))
+                    s.place_piece(*rnd.choice(s.free_squares()))
+
+
+class StateViewTestCase(unittest.TestCase):
+    def test_views_are_read_only(self):
+        s = state.State()
+        self.assertIsInstance(s.board[0], tuple)
+        self.assertIsInstance(s.pieces, frozenset)
+        self.assertRaises(AttributeError, setattr, s, 'foo', 1)
+
+    def test_views_are_cached_until_changed(self):
+        s = state.State()
+        self.assertIs(s.board, s.board)
+        self.assertIs(s.pieces, s.pieces)
+        board, pieces = s.board, s.pieces
+        s.push_pick(4)
+        self.assertIs(s.board, board)
+        self.assertNotIn(4, s.pieces)
+        self.assertIn(4, pieces)
+        s.push_place(3, 3)
+        self.assertEqual(s.board[3][3], 4)
+        self.assertIsNone(board[3][3])
+        s.undo()
+        s.undo()
+        self.assertEqual(s.board, board)
+        self.assertEqual(s.pieces, pieces)
+
+
+class UndoTestCase(unittest.TestCase):
+    def _play_and_undo(self, cls):
+        rnd = random.Random(2)
+        for _ in range(20):
+            s = cls()
+            snapshots = []
+            while not s.has_winner() and not s.is_draw():
+                snapshots.append((s.board, s.pieces, s.held_piece,
+                                  s.has_winner()))
+                s.push_pick(rnd.choice(sorted(s.pieces)))
+                snapshots.append((s.board, s.pieces, s.held_piece,
+                                  s.has_winner()))
+                s.push_place(*rnd.choice(s.free_squares()))
+            while snapshots:
+                s.undo()
+                self.assertEqual((s.board, s.pieces, s.held_piece,
+                                  s.has_winner()), snapshots.pop())
+
+    def test_state_undo(self):
+        self._play_and_undo(state.State)
+
+    def test_bitstate_undo(self):
+        self._play_and_undo(state.BitState)
+
+    def test_failed_push_is_not_recorded(self):
+        for cls in (state.State, state.BitState):
+            s = cls()
+            s.push_pick(5)
+            self.assertRaises(ValueError, s.push_pick, 6)
+            s.push_place(1, 1)
+            s.undo()
+            s.undo()
+            self.assertEqual(s.pieces, set(range(16)))
+            self.assertIsNone(s.square(1, 1))
+
+
+class ZobristTestCase(unittest.TestCase):
+    def test_key_is_incremental(self):
+        rnd = random.Random(3)
+        for cls in (state.State, state.BitState):
+            s = cls()
+            keys = [s.key]
+            while not s.has_winner() and not s.is_draw():
+                s.push_pick(rnd.choice(sorted(s.pieces)))
+                self.assertEqual(s.key, cls(s.board, s.pieces,
+                                            s.held_piece).key)
+                s.push_place(*rnd.choice(s.free_squares()))
+                self.assertEqual(s.key, cls(s.board, s.pieces).key)
+                self.assertEqual(s.key, s.copy().key)
+                keys.append(s.key)
+            self.assertEqual(len(set(keys)), len(keys))
+            while s._history:
+                s.undo()
+            self.assertEqual(s.key, keys[0])
+
+    def test_transpositions_have_equal_keys(self):
+        a, b = state.State(), state.BitState()
+        for s, moves in ((a, [(3, 0, 0), (7, 1, 1)]),
+                         (b, [(7, 1, 1), (3, 0, 0)])):
+            for piece, row, col in moves:
+                s.pick_piece(piece)
+                s.place_piece(row, col)
+        self.assertEqual(a.key, b.key)
+        a.pick_piece(9)
+        self.assertNotEqual(a.key, b.key)
+
+    def test_pieces_from_iterator(self):
+        for cls in (state.State, state.BitState):
+            s, t = cls(), cls()
+            s.pieces = (p for p in range(16) if p % 3)
+            t.pieces = [p for p in range(16) if p % 3]
+            self.assertEqual(s.pieces, t.pieces)
+            self.assertEqual(s.key, t.key)
+
+
+if __name__ == "__main__":
+    unittest.main()
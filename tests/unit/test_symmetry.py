@@ -0,0 +1,80 @@
+import sys
+sys.path.append('../../')
+import random
+import unittest
+import state
+import symmetry
+
+
+def transform(s, sym, pmap):
+    board = [[None]*4 for _ in range(4)]
+    for i, sq in enumerate(sym):
+        p = s.square(sq >> 2, sq & 3)
+        if p is not None:
+            board[i >> 2][i & 3] = pmap[p]
+    held = pmap[s.held_piece] if s.is_holding() else None
+    return state.State(board, {pmap[p] for p in s.pieces}, held)
+
+
+class SymmetryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.rnd = random.Random(6)
+
+    def random_state(self):
+        s = state.State()
+        for _ in range(self.rnd.randint(0, 12)):
+            s.pick_piece(self.rnd.choice(sorted(s.pieces)))
+            s.place_piece(*self.rnd.choice(s.free_squares()))
+        if self.rnd.random() < 0.7:
+            s.pick_piece(self.rnd.choice(sorted(s.pieces)))
+        return s
+
+    def test_symmetries_preserve_lines(self):
+        self.assertEqual(len(set(symmetry.SQUARE_SYMMETRIES)), 32)
+        self.assertEqual(len(set(symmetry.PIECE_MAPS)), 384)
+        lines = {frozenset(line) for line in state._LINES}
+        for sym in symmetry.SQUARE_SYMMETRIES:
+            self.assertEqual({frozenset(sym[i] for i in line)
+                              for line in state._LINES}, lines)
+
+    def test_key_is_invariant(self):
+        for _ in range(100):
+            s = self.random_state()
+            key = symmetry.canonical_key(s)
+            for _ in range(5):
+                t = transform(s, self.rnd.choice(symmetry.SQUARE_SYMMETRIES),
+                              self.rnd.choice(symmetry.PIECE_MAPS))
+                self.assertEqual(symmetry.canonical_key(t), key)
+                self.assertEqual(t.has_winner(), s.has_winner())
+
+    def test_different_positions_have_different_keys(self):
+        a, b = state.State(), state.State()
+        a.pick_piece(0)
+        a.place_piece(0, 0)
+        b.pick_piece(0)
+        b.place_piece(0, 1)
+        self.assertNotEqual(symmetry.canonical_key(a),
+                            symmetry.canonical_key(b))
+
+    def test_move_mapping(self):
+        for _ in range(50):
+            s = self.random_state()
+            if not s.is_holding() or not s.pieces:
+                continue
+            key, sym, pmap = symmetry.canonical_form(s)
+            c = transform(s, sym, pmap)
+            move = (self.rnd.choice(s.free_squares()),
+                    self.rnd.choice(sorted(s.pieces)))
+            cmove = symmetry.to_canonical_move(move, sym, pmap)
+            self.assertEqual(symmetry.from_canonical_move(cmove, sym, pmap),
+                             move)
+            s.place_piece(*move[0])
+            s.pick_piece(move[1])
+            c.place_piece(*cmove[0])
+            c.pick_piece(cmove[1])
+            self.assertEqual(symmetry.canonical_key(s),
+                             symmetry.canonical_key(c))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import sys
+sys.path.append('../../')
+import os
+import random
+import tempfile
+import unittest
+import gameengine
+import tablebase
+
+
+class TablebaseTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        fd, cls.path = tempfile.mkstemp()
+        os.close(fd)
+        tablebase.build(cls.path, max_pieces=3, positions=10, seed=5)
+        cls.tb = tablebase.Tablebase(cls.path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tb.close()
+        os.remove(cls.path)
+
+    def endgames(self, count):
+        rnd = random.Random(5)
+        states = []
+        while len(states) < count:
+            s = tablebase._random_endgame(rnd, 3)
+            if s is not None:
+                states.append(s)
+        return states
+
+    def test_probe(self):
+        self.assertEqual(self.tb.max_pieces, 3)
+        for s in self.endgames(10):
+            result, distance, (square, piece) = self.tb.probe(s)
+            self.assertIn(result, (tablebase.WIN, tablebase.DRAW,
+                                   tablebase.LOSS))
+            self.assertIn(square, s.free_squares())
+            self.assertIn(piece, s.pieces)
+            self.assertLessEqual(distance, len(s.pieces) + 1)
+        s.place_piece(*s.free_squares()[0])
+        self.assertIsNone(self.tb.probe(s))
+
+    def test_search_keeps_values(self):
+        for s in self.endgames(10):
+            depth = len(s.pieces) + 1
+            plain = gameengine.AI(gameengine.Difficulty.HIGH)
+            ai = gameengine.AI(gameengine.Difficulty.HIGH, tablebase=self.tb)
+            self.assertEqual(ai._maximize(s.copy(), depth)[:2],
+                             plain._maximize(s.copy(), depth)[:2])
+            row, col = ai.choose_square(s)
+            self.assertIsNone(s.square(row, col))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -7,6 +7,7 @@ import importlib
 import player
 import gameengine
 import gameplatform
+import time
 
 
 class GameTestCase(unittest.TestCase):
@@ -48,6 +49,59 @@ class GameTestCase(unittest.TestCase):
             self.assertEqual("Game Over", g.start_with_timer(10))
         
 
+class SymmetricSearchTimeTestCase(unittest.TestCase):
+
+    # Plays games between plain HIGH AIs, and returns their moves
+    def record_games(self, n):
+        games = []
+        for g in range(n):
+            gameengine.seed(g)
+            ais = [gameengine.AI(gameengine.Difficulty.HIGH, book=None)
+                   for _ in range(2)]
+            s = state.State()
+            cp = 0
+            moves = []
+            while not s.has_winner() and not s.is_draw():
+                moves.append(ais[cp].choose_piece(s))
+                s.pick_piece(moves[-1])
+                cp ^= 1
+                moves.append(ais[cp].choose_square(s))
+                s.place_piece(*moves[-1])
+            games.append(moves)
+        return games
+
+    # Has AIs choose every move of the games, which are then played as
+    # recorded, so that all AIs search the same positions. Returns the
+    # number of nodes searched.
+    def replay_games(self, games, symmetric):
+        nodes = 0
+        for g, moves in enumerate(games):
+            gameengine.seed(g)
+            ais = [gameengine.AI(gameengine.Difficulty.HIGH,
+                                 symmetric=symmetric, book=None)
+                   for _ in range(2)]
+            s = state.State()
+            cp = 0
+            for i, move in enumerate(moves):
+                ai = ais[cp]
+                if i % 2 == 0:
+                    ai.choose_piece(s)
+                    s.pick_piece(move)
+                    cp ^= 1
+                else:
+                    ai.choose_square(s)
+                    s.place_piece(*move)
+                nodes += ai.last_stats.nodes
+        return nodes
+
+    # Symmetric search must search fewer nodes than plain search, see
+    # benchmark.py for how long they take
+    def test_symmetric_search_nodes(self):
+        games = self.record_games(10)
+        self.assertLess(self.replay_games(games, True),
+                        self.replay_games(games, False))
+
+
 if __name__ == "__main__":
 #    if len(sys.argv) == 2 and str.isdigit(sys.argv[1]):
 #        r = int(sys.argv[1])